@@ -1,19 +1,414 @@
+import base64
+import csv
+import io
 import json
 import os
-from typing import Dict, Any
+import re
+import time
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
-def get_db_connection():
-    '''Get database connection using DATABASE_URL from environment'''
+CLIENT_ORDERS_LIMIT = 100
+SEARCH_PHONE_MIN_DIGITS = 4
+
+IMPORT_CHUNK_SIZE = 5000
+IMPORT_REJECTED_REPORT_LIMIT = 1000
+IMPORT_FIELD_ALIASES = {
+    'fullName': ('fullName', 'full_name', 'name', 'ФИО'),
+    'phone': ('phone', 'Телефон'),
+    'address': ('address', 'Адрес'),
+    'email': ('email',),
+    'deviceType': ('deviceType', 'device_type'),
+    'deviceModel': ('deviceModel', 'device_model'),
+    'serialNumber': ('serialNumber', 'serial_number')
+}
+
+READ_STICKY_SECONDS = 10
+READ_CONNECT_TIMEOUT = 2
+READ_MARKER_HEADER = 'X-Read-Primary-Until'
+
+def reads_pinned_to_primary(request_headers: Dict[str, Any]) -> bool:
+    '''
+    True while the caller must read its own writes. Clients echo the marker from their
+    last write response, which works across instances.
+    '''
+    marker = request_headers.get(READ_MARKER_HEADER) or request_headers.get(READ_MARKER_HEADER.lower())
+    try:
+        return bool(marker) and float(marker) > time.time()
+    except ValueError:
+        return False
+
+def get_db_connection(read_only: bool = False, request_headers: Optional[Dict[str, Any]] = None):
+    '''
+    Get database connection. Read-only requests go to DATABASE_READ_URL when it is set,
+    unless the caller's reads are pinned to the primary or the replica is unreachable.
+    '''
+    read_url = os.environ.get('DATABASE_READ_URL')
+    if read_only and read_url and not reads_pinned_to_primary(request_headers or {}):
+        try:
+            return psycopg2.connect(read_url, connect_timeout=READ_CONNECT_TIMEOUT)
+        except psycopg2.OperationalError:
+            pass
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+def with_write_marker(response: Dict[str, Any]) -> Dict[str, Any]:
+    '''Attach the read-your-writes marker to a successful write response'''
+    if response.get('statusCode', 500) >= 400:
+        return response
+    response_headers = dict(response.get('headers') or {})
+    response_headers[READ_MARKER_HEADER] = f'{time.time() + READ_STICKY_SECONDS:.3f}'
+    exposed = response_headers.get('Access-Control-Expose-Headers')
+    response_headers['Access-Control-Expose-Headers'] = f'{exposed}, {READ_MARKER_HEADER}' if exposed else READ_MARKER_HEADER
+    return dict(response, headers=response_headers)
+
+def normalize_phone(value: str) -> str:
     '''
-    Business: API для поиска клиентов и их устройств по различным критериям
-    Args: event с httpMethod, queryStringParameters (search, phone, serialNumber)
-    Returns: HTTP response со списком клиентов и их устройств
+    Digits-only phone without the 7/8 country code, matching clients.phone_digits:
+    the code is dropped only from 11-digit numbers or after an explicit "+7".
+    '''
+    digits = re.sub(r'\D', '', value)
+    has_country_code = (
+        (len(digits) == 11 and digits[0] in '78')
+        or value.strip().startswith('+7')
+    )
+    return digits[1:] if has_country_code else digits
+
+def fetch_clients(cursor: Any, candidates_sql: str, candidates_params: Tuple,
+                  order_by: str, device_filter: str = '', device_params: Tuple = ()) -> List[Dict[str, Any]]:
+    '''
+    Pick the top clients first, then attach devices per client through LATERAL,
+    so the device aggregate runs only for the rows actually returned
     '''
+    cursor.execute(f'''
+        SELECT 
+            c.id,
+            c.full_name as "fullName",
+            c.phone,
+            c.address,
+            c.email,
+            d.devices
+        FROM ({candidates_sql}) c
+        CROSS JOIN LATERAL (
+            SELECT COALESCE(
+                json_agg(
+                    json_build_object(
+                        'id', cd.id,
+                        'deviceType', cd.device_type,
+                        'deviceModel', cd.device_model,
+                        'serialNumber', cd.serial_number
+                    ) ORDER BY cd.id
+                ),
+                '[]'::json
+            ) as devices
+            FROM client_devices cd
+            WHERE cd.client_id = c.id {device_filter}
+        ) d
+        ORDER BY {order_by}
+    ''', candidates_params + device_params)
+    return cursor.fetchall()
+
+def get_client_orders(cursor: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    '''Past orders of one client, looked up by clientId or exact phone'''
+    client_id = params.get('clientId', '').strip()
+    phone = params.get('phone', '').strip()
+    
+    if client_id:
+        cursor.execute('SELECT phone FROM clients WHERE id = %s', (int(client_id),))
+        client_row = cursor.fetchone()
+        if not client_row:
+            return {
+                'statusCode': 404,
+                'headers': {'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Client not found'})
+            }
+        phone = client_row['phone']
+    
+    if not phone:
+        return {
+            'statusCode': 400,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'clientId or phone required'})
+        }
+    
+    cursor.execute('''
+        SELECT 
+            order_id as "id",
+            device_type as "deviceType",
+            device_model as "deviceModel",
+            serial_number as "serialNumber",
+            issue,
+            status,
+            repair_type as "repairType",
+            price::float as price,
+            master,
+            repair_description as "repairDescription",
+            TO_CHAR(created_at, 'DD.MM.YYYY') as "createdAt"
+        FROM orders_all
+        WHERE client_phone = %s
+        ORDER BY created_at DESC
+        LIMIT %s
+    ''', (phone, CLIENT_ORDERS_LIMIT))
+    orders = cursor.fetchall()
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps([dict(order) for order in orders], ensure_ascii=False)
+    }
+
+def format_phone(value: str) -> Optional[str]:
+    '''Canonical "+7 (XXX) XXX-XX-XX" form used by the order form, or None if not a full number'''
+    digits = normalize_phone(value)
+    if len(digits) != 10:
+        return None
+    return f'+7 ({digits[0:3]}) {digits[3:6]}-{digits[6:8]}-{digits[8:10]}'
+
+def iter_import_rows(data: str, data_format: str) -> Iterator[Tuple[int, Dict[str, str]]]:
+    '''Yield (line number, row) from CSV with a header line or from NDJSON, one line at a time'''
+    lines = io.StringIO(data)
+    if data_format == 'ndjson':
+        for line_no, line in enumerate(lines, start=1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield line_no, row if isinstance(row, dict) else {'__error__': 'Invalid JSON object'}
+        return
+    
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, row
+
+def read_import_field(row: Dict[str, Any], field: str) -> str:
+    '''Value of an import field under any of its accepted column names'''
+    for alias in IMPORT_FIELD_ALIASES[field]:
+        value = row.get(alias)
+        if value:
+            return str(value).strip()
+    return ''
+
+def merge_import_chunk(cursor: Any, chunk: List[Tuple]) -> Tuple[int, int, int]:
+    '''COPY one chunk into staging and merge it into clients/client_devices set-based'''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(chunk)
+    buffer.seek(0)
+    cursor.copy_expert('''
+        COPY client_import_staging
+        (line_no, full_name, phone, address, email, device_type, device_model, serial_number)
+        FROM STDIN WITH (FORMAT csv)
+    ''', buffer)
+    
+    cursor.execute('''
+        WITH merged AS (
+            INSERT INTO clients (full_name, phone, address, email)
+            SELECT DISTINCT ON (phone) full_name, phone, NULLIF(address, ''), NULLIF(email, '')
+            FROM client_import_staging
+            ORDER BY phone, line_no DESC
+            ON CONFLICT (phone)
+            DO UPDATE SET 
+                full_name = EXCLUDED.full_name,
+                address = COALESCE(EXCLUDED.address, clients.address),
+                email = COALESCE(EXCLUDED.email, clients.email),
+                updated_at = NOW()
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT 
+            COUNT(*) FILTER (WHERE inserted) AS inserted,
+            COUNT(*) FILTER (WHERE NOT inserted) AS updated
+        FROM merged
+    ''')
+    counts = cursor.fetchone()
+    
+    cursor.execute('''
+        INSERT INTO client_devices (client_id, device_type, device_model, serial_number)
+        SELECT c.id, s.device_type, NULLIF(s.device_model, ''), NULLIF(s.serial_number, '')
+        FROM client_import_staging s
+        INNER JOIN clients c ON c.phone = s.phone
+        WHERE s.device_type <> ''
+        ON CONFLICT (client_id, device_key) DO NOTHING
+    ''')
+    devices_added = cursor.rowcount
+    
+    cursor.execute('TRUNCATE client_import_staging')
+    return counts['inserted'], counts['updated'], devices_added
+
+def import_clients(conn: Any, cursor: Any, event: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Bulk import clients from CSV (with header) or NDJSON in the request body.
+    Rows are validated and merged chunk by chunk; each chunk commits and updates
+    client_imports so progress can be polled with action=import-status.
+    '''
+    params = event.get('queryStringParameters', {}) or {}
+    data_format = (params.get('format') or 'csv').lower()
+    data = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        data = base64.b64decode(data).decode('utf-8-sig')
+    
+    if data_format not in ('csv', 'ndjson') or not data.strip():
+        return {
+            'statusCode': 400,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'CSV or NDJSON body required'})
+        }
+    
+    cursor.execute('''
+        INSERT INTO client_imports (status, format)
+        VALUES ('running', %s)
+        RETURNING id
+    ''', (data_format,))
+    import_id = cursor.fetchone()['id']
+    cursor.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS client_import_staging (
+            line_no INTEGER,
+            full_name TEXT,
+            phone TEXT,
+            address TEXT,
+            email TEXT,
+            device_type TEXT,
+            device_model TEXT,
+            serial_number TEXT
+        )
+    ''')
+    conn.commit()
+    
+    stats = {'processed': 0, 'inserted': 0, 'updated': 0, 'devices': 0, 'rejected': 0}
+    rejected_rows = []
+    chunk = []
+    
+    def flush() -> None:
+        inserted, updated, devices_added = merge_import_chunk(cursor, chunk)
+        stats['inserted'] += inserted
+        stats['updated'] += updated
+        stats['devices'] += devices_added
+        cursor.execute('''
+            UPDATE client_imports
+            SET processed_rows = %s, inserted_clients = %s, updated_clients = %s,
+                added_devices = %s, rejected_rows = %s
+            WHERE id = %s
+        ''', (stats['processed'], stats['inserted'], stats['updated'],
+              stats['devices'], stats['rejected'], import_id))
+        conn.commit()
+        chunk.clear()
+    
+    try:
+        for line_no, row in iter_import_rows(data, data_format):
+            stats['processed'] += 1
+            full_name = read_import_field(row, 'fullName')
+            phone = format_phone(read_import_field(row, 'phone'))
+            
+            reason = row.get('__error__')
+            if not reason and not full_name:
+                reason = 'Missing full name'
+            if not reason and not phone:
+                reason = 'Invalid phone'
+            
+            if reason:
+                stats['rejected'] += 1
+                if len(rejected_rows) < IMPORT_REJECTED_REPORT_LIMIT:
+                    rejected_rows.append({'line': line_no, 'reason': reason})
+                continue
+            
+            chunk.append((
+                line_no, full_name, phone,
+                read_import_field(row, 'address'),
+                read_import_field(row, 'email'),
+                read_import_field(row, 'deviceType'),
+                read_import_field(row, 'deviceModel'),
+                read_import_field(row, 'serialNumber')
+            ))
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                flush()
+        
+        if chunk:
+            flush()
+        
+        cursor.execute('''
+            UPDATE client_imports
+            SET status = 'completed', processed_rows = %s, rejected_rows = %s,
+                rejected_report = %s, finished_at = NOW()
+            WHERE id = %s
+        ''', (stats['processed'], stats['rejected'], json.dumps(rejected_rows, ensure_ascii=False), import_id))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        cursor.execute('''
+            UPDATE client_imports
+            SET status = 'failed', error = %s, rejected_report = %s, finished_at = NOW()
+            WHERE id = %s
+        ''', (str(e), json.dumps(rejected_rows, ensure_ascii=False), import_id))
+        conn.commit()
+        return {
+            'statusCode': 500,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e), 'importId': import_id, **stats}, ensure_ascii=False)
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({
+            'importId': import_id,
+            'status': 'completed',
+            **stats,
+            'rejectedRows': rejected_rows
+        }, ensure_ascii=False)
+    }
+
+def get_import_status(cursor: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    import_id = params.get('importId')
+    if not import_id:
+        return {
+            'statusCode': 400,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'importId required'})
+        }
+    
+    cursor.execute('''
+        SELECT 
+            id as "importId",
+            status,
+            format,
+            processed_rows as "processed",
+            inserted_clients as "inserted",
+            updated_clients as "updated",
+            added_devices as "devices",
+            rejected_rows as "rejected",
+            rejected_report as "rejectedRows",
+            error,
+            TO_CHAR(started_at, 'YYYY-MM-DD"T"HH24:MI:SS') as "startedAt",
+            TO_CHAR(finished_at, 'YYYY-MM-DD"T"HH24:MI:SS') as "finishedAt"
+        FROM client_imports
+        WHERE id = %s
+    ''', (int(import_id),))
+    import_row = cursor.fetchone()
+    
+    if not import_row:
+        return {
+            'statusCode': 404,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Import not found'})
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(dict(import_row), ensure_ascii=False)
+    }
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''Route a request; handler adds the read-your-writes marker to write responses'''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -22,13 +417,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Read-Primary-Until',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    conn = get_db_connection()
+    conn = get_db_connection(read_only=method == 'GET', request_headers=event.get('headers') or {})
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
@@ -38,112 +433,69 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             phone = params.get('phone', '').strip()
             serial_number = params.get('serialNumber', '').strip()
             
-            if phone:
-                cursor.execute('''
-                    SELECT 
-                        c.id,
-                        c.full_name as "fullName",
-                        c.phone,
-                        c.address,
-                        c.email,
-                        COALESCE(
-                            json_agg(
-                                json_build_object(
-                                    'id', cd.id,
-                                    'deviceType', cd.device_type,
-                                    'deviceModel', cd.device_model,
-                                    'serialNumber', cd.serial_number
-                                )
-                            ) FILTER (WHERE cd.id IS NOT NULL),
-                            '[]'::json
-                        ) as devices
-                    FROM clients c
-                    LEFT JOIN client_devices cd ON c.id = cd.client_id
-                    WHERE c.phone ILIKE %s
-                    GROUP BY c.id
+            if params.get('action') == 'orders':
+                return get_client_orders(cursor, params)
+            
+            if params.get('action') == 'import-status':
+                return get_import_status(cursor, params)
+            
+            phone_digits = normalize_phone(phone)
+            search_digits = normalize_phone(search)
+            # Free text like "Ленина 15" must not turn into a broad phone_digits LIKE '%15%';
+            # only phone-like queries (mostly digits, enough for trigrams) search phones
+            if (len(search_digits) < SEARCH_PHONE_MIN_DIGITS
+                    or len(search_digits) * 2 < len(re.sub(r'\s', '', search))):
+                search_digits = ''
+            
+            if phone_digits:
+                clients = fetch_clients(cursor, '''
+                    SELECT *, similarity(phone_digits, %s) AS rank
+                    FROM clients
+                    WHERE phone_digits LIKE %s
+                    ORDER BY rank DESC, full_name
                     LIMIT 10
-                ''', (f'%{phone}%',))
+                ''', (phone_digits, f'%{phone_digits}%'), 'c.rank DESC, c.full_name')
+            elif phone:
+                # A phone filter without digits matches nothing, not the newest clients
+                clients = []
             elif serial_number:
-                cursor.execute('''
-                    SELECT 
-                        c.id,
-                        c.full_name as "fullName",
-                        c.phone,
-                        c.address,
-                        c.email,
-                        COALESCE(
-                            json_agg(
-                                json_build_object(
-                                    'id', cd.id,
-                                    'deviceType', cd.device_type,
-                                    'deviceModel', cd.device_model,
-                                    'serialNumber', cd.serial_number
-                                )
-                            ) FILTER (WHERE cd.id IS NOT NULL),
-                            '[]'::json
-                        ) as devices
+                clients = fetch_clients(cursor, '''
+                    SELECT *
                     FROM clients c
-                    INNER JOIN client_devices cd ON c.id = cd.client_id
-                    WHERE cd.serial_number ILIKE %s
-                    GROUP BY c.id
+                    WHERE EXISTS (
+                        SELECT 1 FROM client_devices cd
+                        WHERE cd.client_id = c.id AND cd.serial_number ILIKE %s
+                    )
+                    ORDER BY c.full_name
                     LIMIT 10
-                ''', (f'%{serial_number}%',))
+                ''', (f'%{serial_number}%',), 'c.full_name',
+                    'AND cd.serial_number ILIKE %s', (f'%{serial_number}%',))
             elif search:
-                cursor.execute('''
-                    SELECT 
-                        c.id,
-                        c.full_name as "fullName",
-                        c.phone,
-                        c.address,
-                        c.email,
-                        COALESCE(
-                            json_agg(
-                                json_build_object(
-                                    'id', cd.id,
-                                    'deviceType', cd.device_type,
-                                    'deviceModel', cd.device_model,
-                                    'serialNumber', cd.serial_number
-                                )
-                            ) FILTER (WHERE cd.id IS NOT NULL),
-                            '[]'::json
-                        ) as devices
-                    FROM clients c
-                    LEFT JOIN client_devices cd ON c.id = cd.client_id
+                clients = fetch_clients(cursor, '''
+                    SELECT *,
+                        GREATEST(
+                            word_similarity(%s, full_name),
+                            word_similarity(%s, COALESCE(address, '')),
+                            CASE WHEN %s <> '' THEN similarity(phone_digits, %s) ELSE 0 END
+                        ) AS rank
+                    FROM clients
                     WHERE 
-                        c.full_name ILIKE %s OR 
-                        c.phone ILIKE %s OR 
-                        c.address ILIKE %s
-                    GROUP BY c.id
-                    ORDER BY c.full_name
+                        full_name ILIKE %s OR 
+                        address ILIKE %s OR 
+                        (%s <> '' AND phone_digits LIKE %s)
+                    ORDER BY rank DESC, full_name
                     LIMIT 20
-                ''', (f'%{search}%', f'%{search}%', f'%{search}%'))
+                ''', (
+                    search, search, search_digits, search_digits,
+                    f'%{search}%', f'%{search}%', search_digits, f'%{search_digits}%'
+                ), 'c.rank DESC, c.full_name')
             else:
-                cursor.execute('''
-                    SELECT 
-                        c.id,
-                        c.full_name as "fullName",
-                        c.phone,
-                        c.address,
-                        c.email,
-                        COALESCE(
-                            json_agg(
-                                json_build_object(
-                                    'id', cd.id,
-                                    'deviceType', cd.device_type,
-                                    'deviceModel', cd.device_model,
-                                    'serialNumber', cd.serial_number
-                                )
-                            ) FILTER (WHERE cd.id IS NOT NULL),
-                            '[]'::json
-                        ) as devices
-                    FROM clients c
-                    LEFT JOIN client_devices cd ON c.id = cd.client_id
-                    GROUP BY c.id
-                    ORDER BY c.created_at DESC
+                clients = fetch_clients(cursor, '''
+                    SELECT *
+                    FROM clients
+                    ORDER BY created_at DESC
                     LIMIT 50
-                ''')
-            
-            clients = cursor.fetchall()
+                ''', (), 'c.created_at DESC')
             
             return {
                 'statusCode': 200,
@@ -155,6 +507,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
         
         elif method == 'POST':
+            params = event.get('queryStringParameters', {}) or {}
+            if params.get('action') == 'import':
+                return import_clients(conn, cursor, event)
+            
             body_data = json.loads(event.get('body', '{}'))
             
             full_name = body_data.get('fullName', '').strip()
@@ -192,6 +548,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 cursor.execute('''
                     INSERT INTO client_devices (client_id, device_type, device_model, serial_number)
                     VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (client_id, device_key)
+                    DO UPDATE SET 
+                        device_type = EXCLUDED.device_type,
+                        device_model = COALESCE(EXCLUDED.device_model, client_devices.device_model)
                 ''', (client_id, device_type, device_model or None, serial_number or None))
             
             conn.commit()
@@ -214,3 +574,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     finally:
         cursor.close()
         conn.close()
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: API для поиска клиентов и их устройств по различным критериям
+    Args: event с httpMethod, queryStringParameters (search, phone, serialNumber)
+    Returns: HTTP response со списком клиентов и их устройств
+    '''
+    response = handle_request(event, context)
+    if event.get('httpMethod', 'GET') in ('GET', 'OPTIONS'):
+        return response
+    return with_write_marker(response)
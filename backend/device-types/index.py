@@ -1,19 +1,87 @@
 import json
 import os
-from typing import Dict, Any
+import time
+from typing import Dict, Any, Callable, List, Optional, Tuple
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
-def get_db_connection():
-    '''Get database connection using DATABASE_URL from environment'''
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+_response_cache: Dict[Tuple, Tuple[int, str]] = {}
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+def cached_json_response(cursor: Any, cache_name: str, cache_key: Tuple, request_headers: Dict[str, Any],
+                         load: Callable[[], Any]) -> Dict[str, Any]:
     '''
-    Business: API для управления справочником типов техники (CRUD операции)
-    Args: event с httpMethod, body, queryStringParameters, headers с X-User-Role
-    Returns: HTTP response с данными типов техники или результатом операции
+    Serve JSON from the module-level cache while cache_versions[cache_name] is unchanged.
+    Writes bump the version via trigger, so warm invocations only pay for one version lookup.
+    '''
+    cursor.execute('SELECT version FROM cache_versions WHERE name = %s', (cache_name,))
+    version_row = cursor.fetchone()
+    version = version_row['version'] if version_row else None
+    
+    cached = _response_cache.get(cache_key)
+    if version is not None and cached and cached[0] == version:
+        body = cached[1]
+    else:
+        body = json.dumps(load(), ensure_ascii=False)
+        if version is not None:
+            _response_cache[cache_key] = (version, body)
+    
+    response_headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag',
+        'Cache-Control': 'no-cache'
+    }
+    if version is None:
+        return {'statusCode': 200, 'headers': response_headers, 'body': body}
+    
+    etag = f'"{cache_name}-{version}"'
+    response_headers['ETag'] = etag
+    if_none_match = request_headers.get('If-None-Match') or request_headers.get('if-none-match')
+    if if_none_match == etag:
+        return {'statusCode': 304, 'headers': response_headers, 'body': ''}
+    
+    return {'statusCode': 200, 'headers': response_headers, 'body': body}
+
+READ_STICKY_SECONDS = 10
+READ_CONNECT_TIMEOUT = 2
+READ_MARKER_HEADER = 'X-Read-Primary-Until'
+
+def reads_pinned_to_primary(request_headers: Dict[str, Any]) -> bool:
     '''
+    True while the caller must read its own writes. Clients echo the marker from their
+    last write response, which works across instances.
+    '''
+    marker = request_headers.get(READ_MARKER_HEADER) or request_headers.get(READ_MARKER_HEADER.lower())
+    try:
+        return bool(marker) and float(marker) > time.time()
+    except ValueError:
+        return False
+
+def get_db_connection(read_only: bool = False, request_headers: Optional[Dict[str, Any]] = None):
+    '''
+    Get database connection. Read-only requests go to DATABASE_READ_URL when it is set,
+    unless the caller's reads are pinned to the primary or the replica is unreachable.
+    '''
+    read_url = os.environ.get('DATABASE_READ_URL')
+    if read_only and read_url and not reads_pinned_to_primary(request_headers or {}):
+        try:
+            return psycopg2.connect(read_url, connect_timeout=READ_CONNECT_TIMEOUT)
+        except psycopg2.OperationalError:
+            pass
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
+def with_write_marker(response: Dict[str, Any]) -> Dict[str, Any]:
+    '''Attach the read-your-writes marker to a successful write response'''
+    if response.get('statusCode', 500) >= 400:
+        return response
+    response_headers = dict(response.get('headers') or {})
+    response_headers[READ_MARKER_HEADER] = f'{time.time() + READ_STICKY_SECONDS:.3f}'
+    exposed = response_headers.get('Access-Control-Expose-Headers')
+    response_headers['Access-Control-Expose-Headers'] = f'{exposed}, {READ_MARKER_HEADER}' if exposed else READ_MARKER_HEADER
+    return dict(response, headers=response_headers)
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''Route a request; handler adds the read-your-writes marker to write responses'''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -22,13 +90,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Role',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Role, If-None-Match, X-Read-Primary-Until',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    conn = get_db_connection()
+    conn = get_db_connection(read_only=method == 'GET', request_headers=event.get('headers') or {})
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
@@ -36,36 +104,32 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             params = event.get('queryStringParameters', {}) or {}
             category = params.get('category')
         
-            if category:
-                cursor.execute('''
-                    SELECT 
-                        id,
-                        name,
-                        category
-                    FROM device_types
-                    WHERE category = %s
-                    ORDER BY name
-                ''', (category,))
-            else:
-                cursor.execute('''
-                    SELECT 
-                        id,
-                        name,
-                        category
-                    FROM device_types
-                    ORDER BY category, name
-                ''')
-            
-            device_types = cursor.fetchall()
+            def load_device_types() -> List[Dict[str, Any]]:
+                if category:
+                    cursor.execute('''
+                        SELECT 
+                            id,
+                            name,
+                            category
+                        FROM device_types
+                        WHERE category = %s
+                        ORDER BY name
+                    ''', (category,))
+                else:
+                    cursor.execute('''
+                        SELECT 
+                            id,
+                            name,
+                            category
+                        FROM device_types
+                        ORDER BY category, name
+                    ''')
+                return [dict(dt) for dt in cursor.fetchall()]
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps([dict(dt) for dt in device_types], ensure_ascii=False)
-            }
+            return cached_json_response(
+                cursor, 'device_types', ('device_types', category), event.get('headers', {}) or {},
+                load_device_types
+            )
         
         elif method == 'POST':
             headers = event.get('headers', {})
@@ -148,4 +212,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: API для управления справочником типов техники (CRUD операции)
+    Args: event с httpMethod, body, queryStringParameters, headers с X-User-Role
+    Returns: HTTP response с данными типов техники или результатом операции
+    '''
+    response = handle_request(event, context)
+    if event.get('httpMethod', 'GET') in ('GET', 'OPTIONS'):
+        return response
+    return with_write_marker(response)
@@ -1,19 +1,326 @@
 import json
+import math
 import os
-from typing import Dict, Any, List
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Any, Callable, List, Optional, Tuple
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
-def get_db_connection():
-    '''Get database connection using DATABASE_URL from environment'''
+BULK_MAX_PAIRS = 1000
+BATCH_MAX_ORDERS = 500
+
+_response_cache: Dict[Tuple, Tuple[int, str]] = {}
+
+def cached_json_response(cursor: Any, cache_name: str, cache_key: Tuple, request_headers: Dict[str, Any],
+                         load: Callable[[], Any]) -> Dict[str, Any]:
+    '''
+    Serve JSON from the module-level cache while cache_versions[cache_name] is unchanged.
+    Writes bump the version via trigger, so warm invocations only pay for one version lookup.
+    '''
+    cursor.execute('SELECT version FROM cache_versions WHERE name = %s', (cache_name,))
+    version_row = cursor.fetchone()
+    version = version_row['version'] if version_row else None
+    
+    cached = _response_cache.get(cache_key)
+    if version is not None and cached and cached[0] == version:
+        body = cached[1]
+    else:
+        body = json.dumps(load(), ensure_ascii=False)
+        if version is not None:
+            _response_cache[cache_key] = (version, body)
+    
+    response_headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag',
+        'Cache-Control': 'no-cache'
+    }
+    if version is None:
+        return {'statusCode': 200, 'headers': response_headers, 'body': body}
+    
+    etag = f'"{cache_name}-{version}"'
+    response_headers['ETag'] = etag
+    if_none_match = request_headers.get('If-None-Match') or request_headers.get('if-none-match')
+    if if_none_match == etag:
+        return {'statusCode': 304, 'headers': response_headers, 'body': ''}
+    
+    return {'statusCode': 200, 'headers': response_headers, 'body': body}
+
+READ_STICKY_SECONDS = 10
+READ_CONNECT_TIMEOUT = 2
+READ_MARKER_HEADER = 'X-Read-Primary-Until'
+_recent_writes: Dict[str, float] = {}
+
+def reads_pinned_to_primary(request_headers: Dict[str, Any], sticky_key: Optional[str] = None) -> bool:
+    '''
+    True while the caller must read its own writes. Clients echo the marker from their
+    last write response, which works across instances; within a warm container writes
+    are also remembered per X-User-Id and for callers that sent none.
+    '''
+    marker = request_headers.get(READ_MARKER_HEADER) or request_headers.get(READ_MARKER_HEADER.lower())
+    try:
+        if marker and float(marker) > time.time():
+            return True
+    except ValueError:
+        pass
+    now = time.time()
+    return any(now - _recent_writes.get(key, 0) <= READ_STICKY_SECONDS for key in (sticky_key or '', ''))
+
+def get_db_connection(read_only: bool = False, request_headers: Optional[Dict[str, Any]] = None, sticky_key: Optional[str] = None):
+    '''
+    Get database connection. Read-only requests go to DATABASE_READ_URL when it is set,
+    unless the caller's reads are pinned to the primary or the replica is unreachable.
+    '''
+    read_url = os.environ.get('DATABASE_READ_URL')
+    if read_only and read_url and not reads_pinned_to_primary(request_headers or {}, sticky_key):
+        try:
+            return psycopg2.connect(read_url, connect_timeout=READ_CONNECT_TIMEOUT)
+        except psycopg2.OperationalError:
+            pass
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+def remember_write(sticky_key: Optional[str] = None) -> None:
+    '''Pin the caller's reads in this container to the primary for READ_STICKY_SECONDS'''
+    _recent_writes[sticky_key or ''] = time.time()
+
+def with_write_marker(response: Dict[str, Any]) -> Dict[str, Any]:
+    '''Attach the read-your-writes marker to a successful write response'''
+    if response.get('statusCode', 500) >= 400:
+        return response
+    response_headers = dict(response.get('headers') or {})
+    response_headers[READ_MARKER_HEADER] = f'{time.time() + READ_STICKY_SECONDS:.3f}'
+    exposed = response_headers.get('Access-Control-Expose-Headers')
+    response_headers['Access-Control-Expose-Headers'] = f'{exposed}, {READ_MARKER_HEADER}' if exposed else READ_MARKER_HEADER
+    return dict(response, headers=response_headers)
+
+RATE_LIMIT_PER_SECOND = 5
+RATE_LIMIT_BURST = 20
+_buckets: Dict[str, Tuple[float, float]] = {}
+_buckets_lock = threading.Lock()
+_inflight: Dict[Tuple, Future] = {}
+_inflight_lock = threading.Lock()
+
+def take_token(key: str) -> float:
+    '''Spend one token from the caller's bucket; returns 0 if admitted, else seconds until the next token'''
+    now = time.monotonic()
+    with _buckets_lock:
+        tokens, updated = _buckets.get(key, (RATE_LIMIT_BURST, now))
+        tokens = min(RATE_LIMIT_BURST, tokens + (now - updated) * RATE_LIMIT_PER_SECOND)
+        if tokens < 1:
+            _buckets[key] = (tokens, now)
+            return (1 - tokens) / RATE_LIMIT_PER_SECOND
+        _buckets[key] = (tokens - 1, now)
+        return 0
+
+def coalesce(key: Tuple, compute: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    '''Run compute once for concurrent identical requests; followers wait for the leader's response'''
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+    
+    if leader:
+        try:
+            future.set_result(compute())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with _inflight_lock:
+                _inflight.pop(key, None)
+    
+    response = future.result()
+    return dict(response, headers=dict(response.get('headers', {})))
+
+def bulk_update_order_users(conn: Any, cursor: Any, body_data: Dict[str, Any]) -> Dict[str, Any]:
     '''
-    Business: API для управления участниками заказов и получения пользователей
-    Args: event с httpMethod, body, pathParams, queryStringParameters
-    Returns: HTTP response с данными участников заказа или списком пользователей
+    Bulk add/remove/replace of order participants in one transaction.
+    Pairs come either as "pairs" [{orderId, userId, role}] or as the cross
+    product of "orderIds" and "userIds" with a shared "role".
+    Replace drops, per order, assignments with the same role that are not listed.
+    '''
+    operation = body_data.get('operation')
+    default_role = body_data.get('role', 'assigned')
+    
+    if operation not in ('add', 'remove', 'replace'):
+        return {
+            'statusCode': 400,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'operation must be add, remove or replace'})
+        }
+    
+    pairs = [
+        (str(pair.get('orderId')), int(pair.get('userId')), pair.get('role', default_role))
+        for pair in body_data.get('pairs') or []
+        if pair.get('orderId') and pair.get('userId')
+    ]
+    for order_id in body_data.get('orderIds') or []:
+        for user_id in body_data.get('userIds') or []:
+            pairs.append((str(order_id), int(user_id), default_role))
+    
+    if not pairs and operation != 'replace':
+        return {
+            'statusCode': 400,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'pairs or orderIds and userIds required'})
+        }
+    
+    if len(pairs) > BULK_MAX_PAIRS:
+        return {
+            'statusCode': 400,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'At most {BULK_MAX_PAIRS} pairs per request'})
+        }
+    
+    order_ids = sorted(
+        {pair[0] for pair in pairs} | {str(order_id) for order_id in body_data.get('orderIds') or []}
+    )
+    cursor.execute('SELECT order_id, id FROM orders WHERE order_id = ANY(%s)', (order_ids,))
+    order_db_ids = {row['order_id']: row['id'] for row in cursor.fetchall()}
+    missing_orders = [order_id for order_id in order_ids if order_id not in order_db_ids]
+    
+    resolved = [
+        (order_db_ids[order_id], user_id, role)
+        for order_id, user_id, role in pairs
+        if order_id in order_db_ids
+    ]
+    pair_order_ids = [pair[0] for pair in resolved]
+    pair_user_ids = [pair[1] for pair in resolved]
+    pair_roles = [pair[2] for pair in resolved]
+    
+    added = 0
+    removed = 0
+    
+    if operation == 'remove':
+        cursor.execute('''
+            DELETE FROM order_users ou
+            USING unnest(%s::int[], %s::int[]) AS p(order_id, user_id)
+            WHERE ou.order_id = p.order_id AND ou.user_id = p.user_id
+        ''', (pair_order_ids, pair_user_ids))
+        removed = cursor.rowcount
+    
+    if operation == 'replace':
+        replaced_orders = sorted({order_db_ids[order_id] for order_id in order_ids if order_id in order_db_ids})
+        replaced_roles = sorted(set(pair_roles) or {default_role})
+        cursor.execute('''
+            DELETE FROM order_users ou
+            WHERE ou.order_id = ANY(%s::int[])
+              AND ou.role = ANY(%s::text[])
+              AND NOT EXISTS (
+                  SELECT 1
+                  FROM unnest(%s::int[], %s::int[]) AS p(order_id, user_id)
+                  WHERE p.order_id = ou.order_id AND p.user_id = ou.user_id
+              )
+        ''', (replaced_orders, replaced_roles, pair_order_ids, pair_user_ids))
+        removed = cursor.rowcount
+    
+    if operation in ('add', 'replace') and resolved:
+        cursor.execute('''
+            INSERT INTO order_users (order_id, user_id, role)
+            SELECT order_id, user_id, role
+            FROM unnest(%s::int[], %s::int[], %s::text[]) AS p(order_id, user_id, role)
+            ON CONFLICT (order_id, user_id) DO NOTHING
+        ''', (pair_order_ids, pair_user_ids, pair_roles))
+        added = cursor.rowcount
+    
+    conn.commit()
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({
+            'success': True,
+            'operation': operation,
+            'added': added,
+            'removed': removed,
+            'missingOrders': missing_orders
+        }, ensure_ascii=False)
+    }
+
+def get_batch_order_users(cursor: Any, params: Dict[str, Any], headers: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Participants grouped by order for many orders in one joined query:
+    explicit orderIds, or every order visible to X-User-Id with visible=true.
+    compact=true returns only user IDs per order.
     '''
+    order_ids = [order_id.strip() for order_id in (params.get('orderIds') or '').split(',') if order_id.strip()]
+    compact = params.get('compact') == 'true'
+    viewer_id = headers.get('X-User-Id') or headers.get('x-user-id')
+    
+    if params.get('visible') == 'true':
+        if not viewer_id:
+            return {
+                'statusCode': 400,
+                'headers': {'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'X-User-Id required'})
+            }
+        order_filter = 'o.id IN (SELECT order_id FROM order_users WHERE user_id = %s)'
+        filter_params = (int(viewer_id),)
+    elif order_ids:
+        if len(order_ids) > BATCH_MAX_ORDERS:
+            return {
+                'statusCode': 400,
+                'headers': {'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': f'At most {BATCH_MAX_ORDERS} orderIds per request'})
+            }
+        order_filter = 'o.order_id = ANY(%s)'
+        filter_params = (order_ids,)
+    else:
+        return {
+            'statusCode': 400,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'orderIds or visible=true required'})
+        }
+    
+    if compact:
+        cursor.execute(f'''
+            SELECT o.order_id, ou.user_id
+            FROM orders o
+            INNER JOIN order_users ou ON ou.order_id = o.id
+            WHERE {order_filter}
+            ORDER BY o.order_id, ou.added_at DESC
+        ''', filter_params)
+    else:
+        cursor.execute(f'''
+            SELECT 
+                o.order_id,
+                ou.id,
+                ou.user_id as "userId",
+                u.username,
+                u.full_name as "fullName",
+                u.role,
+                u.avatar_url as "avatarUrl",
+                ou.role as "assignmentRole",
+                TO_CHAR(ou.added_at, 'DD.MM.YYYY HH24:MI') as "addedAt"
+            FROM orders o
+            INNER JOIN order_users ou ON ou.order_id = o.id
+            INNER JOIN users u ON ou.user_id = u.id
+            WHERE {order_filter}
+            ORDER BY o.order_id, ou.added_at DESC
+        ''', filter_params)
+    
+    grouped = {order_id: [] for order_id in order_ids}
+    for row in cursor.fetchall():
+        participants = grouped.setdefault(row.pop('order_id'), [])
+        participants.append(row['user_id'] if compact else dict(row))
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(grouped, ensure_ascii=False)
+    }
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''Route a request that has passed admission control'''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -22,13 +329,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, If-None-Match, X-Read-Primary-Until',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    conn = get_db_connection()
+    request_headers = event.get('headers', {}) or {}
+    viewer_id = request_headers.get('X-User-Id') or request_headers.get('x-user-id')
+    if method != 'GET':
+        remember_write(viewer_id)
+    conn = get_db_connection(read_only=method == 'GET', request_headers=request_headers, sticky_key=viewer_id)
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
@@ -37,26 +348,25 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             order_id = params.get('orderId')
             list_users = params.get('listUsers')
             
+            if params.get('action') == 'batch':
+                return get_batch_order_users(cursor, params, event.get('headers', {}) or {})
+            
             if list_users == 'true':
-                cursor.execute('''
-                    SELECT 
-                        id,
-                        username,
-                        full_name as "fullName",
-                        role
-                    FROM users
-                    ORDER BY full_name
-                ''')
-                users = cursor.fetchall()
+                def load_users() -> List[Dict[str, Any]]:
+                    cursor.execute('''
+                        SELECT 
+                            id,
+                            username,
+                            full_name as "fullName",
+                            role
+                        FROM users
+                        ORDER BY full_name
+                    ''')
+                    return [dict(user) for user in cursor.fetchall()]
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps([dict(user) for user in users], ensure_ascii=False)
-                }
+                return cached_json_response(
+                    cursor, 'users', ('users',), event.get('headers', {}) or {}, load_users
+                )
             
             if not order_id:
                 return {
@@ -108,6 +418,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         elif method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
+            params = event.get('queryStringParameters', {}) or {}
+            
+            if params.get('action') == 'bulk':
+                return bulk_update_order_users(conn, cursor, body_data)
+            
             order_id = body_data.get('orderId')
             user_id = body_data.get('userId')
             role = body_data.get('role', 'assigned')
@@ -204,4 +519,43 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: API для управления участниками заказов и получения пользователей
+    Args: event с httpMethod, body, pathParams, queryStringParameters
+    Returns: HTTP response с данными участников заказа или списком пользователей
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    headers = event.get('headers', {}) or {}
+    user_id = headers.get('X-User-Id') or headers.get('x-user-id')
+    
+    if method == 'OPTIONS':
+        return handle_request(event, context)
+    
+    if user_id:
+        retry_after = take_token(user_id)
+        if retry_after:
+            return {
+                'statusCode': 429,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Expose-Headers': 'Retry-After',
+                    'Retry-After': str(math.ceil(retry_after))
+                },
+                'body': json.dumps({'error': 'Too many requests'})
+            }
+    
+    if method != 'GET':
+        return with_write_marker(handle_request(event, context))
+    
+    query_params = event.get('queryStringParameters', {}) or {}
+    key = (
+        tuple(sorted(query_params.items())),
+        user_id,
+        headers.get('If-None-Match') or headers.get('if-none-match'),
+        reads_pinned_to_primary(headers, user_id)
+    )
+    return coalesce(key, lambda: handle_request(event, context))
@@ -1,27 +1,325 @@
 import json
 import os
-from typing import Dict, Any, List
+import csv
+import math
+import uuid
+import base64
+import tempfile
+import time
+import threading
+from concurrent.futures import Future
+from typing import Dict, Any, Callable, List, Tuple, Optional
 from decimal import Decimal
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from datetime import datetime
+from psycopg2.errors import LockNotAvailable
+from datetime import datetime, date, timedelta, timezone
 
-def get_db_connection():
-    '''Get database connection using DATABASE_URL from environment'''
+PARTITIONED_TABLES = (
+    ('order_chat_messages', 'timestamp'),
+    ('status_history', 'changed_at')
+)
+PARTITION_DETACH_MARGIN_MONTHS = 3
+
+ARCHIVE_AFTER_MONTHS = 6
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_MAX_BATCHES = 50
+ARCHIVE_LOCK_TIMEOUT = '2s'
+
+CHAT_BACKFILL_BATCH_SIZE = 5000
+
+EXPORT_ITERSIZE = 2000
+EXPORT_INLINE_LIMIT = 2 * 1024 * 1024
+EXPORT_URL_EXPIRES = 60 * 60
+EXPORT_PREFIX = 'exports/'
+EXPORT_TTL_HOURS = 24
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+XLSX_MAX_ROWS = 1048576
+
+ORDER_LIST_COLUMNS = '''
+    o.order_id as "id",
+    o.client_name as "clientName",
+    o.client_address as "clientAddress",
+    o.client_phone as "clientPhone",
+    o.device_type as "deviceType",
+    o.device_model as "deviceModel",
+    o.serial_number as "serialNumber",
+    o.issue,
+    o.appearance,
+    o.accessories,
+    o.status,
+    o.priority,
+    o.repair_type as "repairType",
+    TO_CHAR(o.created_at, 'DD.MM.YYYY') as "createdAt",
+    o.created_time as "createdTime",
+    o.price,
+    o.master,
+    o.history,
+    o.repair_description as "repairDescription",
+    TO_CHAR(o.status_deadline, 'YYYY-MM-DD"T"HH24:MI:SS') as "statusDeadline",
+    TO_CHAR(o.status_changed_at, 'YYYY-MM-DD"T"HH24:MI:SS') as "statusChangedAt",
+    o.is_overdue as "isOverdue"
+'''
+
+_s3_client = None
+_user_avatars: Tuple[Optional[int], Dict[int, Optional[str]]] = (None, {})
+
+READ_STICKY_SECONDS = 10
+READ_CONNECT_TIMEOUT = 2
+READ_MARKER_HEADER = 'X-Read-Primary-Until'
+_recent_writes: Dict[str, float] = {}
+
+def reads_pinned_to_primary(request_headers: Dict[str, Any], sticky_key: Optional[str] = None) -> bool:
+    '''
+    True while the caller must read its own writes. Clients echo the marker from their
+    last write response, which works across instances; within a warm container writes
+    are also remembered per X-User-Id and for callers that sent none.
+    '''
+    marker = request_headers.get(READ_MARKER_HEADER) or request_headers.get(READ_MARKER_HEADER.lower())
+    try:
+        if marker and float(marker) > time.time():
+            return True
+    except ValueError:
+        pass
+    now = time.time()
+    return any(now - _recent_writes.get(key, 0) <= READ_STICKY_SECONDS for key in (sticky_key or '', ''))
+
+def get_db_connection(read_only: bool = False, request_headers: Optional[Dict[str, Any]] = None, sticky_key: Optional[str] = None):
+    '''
+    Get database connection. Read-only requests go to DATABASE_READ_URL when it is set,
+    unless the caller's reads are pinned to the primary or the replica is unreachable.
+    '''
+    read_url = os.environ.get('DATABASE_READ_URL')
+    if read_only and read_url and not reads_pinned_to_primary(request_headers or {}, sticky_key):
+        try:
+            return psycopg2.connect(read_url, connect_timeout=READ_CONNECT_TIMEOUT)
+        except psycopg2.OperationalError:
+            pass
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
+def remember_write(sticky_key: Optional[str] = None) -> None:
+    '''Pin the caller's reads in this container to the primary for READ_STICKY_SECONDS'''
+    _recent_writes[sticky_key or ''] = time.time()
+
+def with_write_marker(response: Dict[str, Any]) -> Dict[str, Any]:
+    '''Attach the read-your-writes marker to a successful write response'''
+    if response.get('statusCode', 500) >= 400:
+        return response
+    response_headers = dict(response.get('headers') or {})
+    response_headers[READ_MARKER_HEADER] = f'{time.time() + READ_STICKY_SECONDS:.3f}'
+    exposed = response_headers.get('Access-Control-Expose-Headers')
+    response_headers['Access-Control-Expose-Headers'] = f'{exposed}, {READ_MARKER_HEADER}' if exposed else READ_MARKER_HEADER
+    return dict(response, headers=response_headers)
+
 def decimal_default(obj):
     '''JSON encoder for Decimal objects'''
     if isinstance(obj, Decimal):
         return float(obj)
     raise TypeError
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+RATE_LIMIT_PER_SECOND = 5
+RATE_LIMIT_BURST = 20
+_buckets: Dict[str, Tuple[float, float]] = {}
+_buckets_lock = threading.Lock()
+_inflight: Dict[Tuple, Future] = {}
+_inflight_lock = threading.Lock()
+
+def take_token(key: str) -> float:
+    '''Spend one token from the caller's bucket; returns 0 if admitted, else seconds until the next token'''
+    now = time.monotonic()
+    with _buckets_lock:
+        tokens, updated = _buckets.get(key, (RATE_LIMIT_BURST, now))
+        tokens = min(RATE_LIMIT_BURST, tokens + (now - updated) * RATE_LIMIT_PER_SECOND)
+        if tokens < 1:
+            _buckets[key] = (tokens, now)
+            return (1 - tokens) / RATE_LIMIT_PER_SECOND
+        _buckets[key] = (tokens - 1, now)
+        return 0
+
+def coalesce(key: Tuple, compute: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    '''Run compute once for concurrent identical requests; followers wait for the leader's response'''
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+    
+    if leader:
+        try:
+            future.set_result(compute())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with _inflight_lock:
+                _inflight.pop(key, None)
+    
+    response = future.result()
+    return dict(response, headers=dict(response.get('headers', {})))
+
+def get_s3_client():
+    '''Get S3 client, importing boto3 lazily and reusing it across warm invocations'''
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+        _s3_client = boto3.client(
+            's3',
+            endpoint_url=os.environ.get('S3_ENDPOINT', 'https://storage.yandexcloud.net'),
+            aws_access_key_id=os.environ.get('S3_ACCESS_KEY'),
+            aws_secret_access_key=os.environ.get('S3_SECRET_KEY')
+        )
+    return _s3_client
+
+def get_user_avatars(cursor) -> Dict[int, Optional[str]]:
+    '''User id -> avatar_url map, reloaded only when cache_versions['users'] changes'''
+    global _user_avatars
+    cursor.execute("SELECT version FROM cache_versions WHERE name = 'users'")
+    version_row = cursor.fetchone()
+    version = version_row['version'] if version_row else None
+    
+    if version is None or _user_avatars[0] != version:
+        cursor.execute('SELECT id, avatar_url FROM users')
+        _user_avatars = (version, {row['id']: row['avatar_url'] for row in cursor.fetchall()})
+    return _user_avatars[1]
+
+def purge_expired_exports(s3_client, s3_bucket: str) -> None:
+    '''Delete one listing page of export files older than EXPORT_TTL_HOURS; media GC sweeps the rest'''
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=EXPORT_TTL_HOURS)
+    response = s3_client.list_objects_v2(Bucket=s3_bucket, Prefix=EXPORT_PREFIX, MaxKeys=1000)
+    expired = [{'Key': obj['Key']} for obj in response.get('Contents', []) if obj['LastModified'] < cutoff]
+    if expired:
+        s3_client.delete_objects(Bucket=s3_bucket, Delete={'Objects': expired, 'Quiet': True})
+
+def build_orders_list_query(user_id: Optional[str], include_archived: bool) -> Tuple[str, tuple]:
+    '''Order list SQL shared by the list GET and the export, honouring X-User-Id and includeArchived'''
+    orders_table = 'orders_all' if include_archived else 'orders'
+    if user_id:
+        order_users_table = 'order_users_all' if include_archived else 'order_users'
+        return f'''
+            SELECT {ORDER_LIST_COLUMNS}
+            FROM {orders_table} o
+            INNER JOIN {order_users_table} ou ON o.id = ou.order_id
+            WHERE ou.user_id = %s
+            ORDER BY o.created_at DESC
+        ''', (int(user_id),)
+    return f'''
+        SELECT {ORDER_LIST_COLUMNS}
+        FROM {orders_table} o
+        ORDER BY o.created_at DESC
+    ''', ()
+
+def export_cell(value: Any) -> Any:
+    '''Convert a DB value to something both csv and xlsxwriter write as-is'''
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+def write_export(export_cursor, export_format: str, path: str) -> int:
+    '''Stream rows from a named cursor into a CSV or constant-memory XLSX file, one chunk at a time'''
+    rows = export_cursor.fetchmany(EXPORT_ITERSIZE)
+    columns = [column.name for column in export_cursor.description]
+    written = 0
+    
+    if export_format == 'csv':
+        with open(path, 'w', encoding='utf-8-sig', newline='') as out:
+            writer = csv.writer(out, delimiter=';')
+            writer.writerow(columns)
+            while rows:
+                writer.writerows([export_cell(value) for value in row] for row in rows)
+                written += len(rows)
+                rows = export_cursor.fetchmany(EXPORT_ITERSIZE)
+        return written
+    
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(path, {
+        'constant_memory': True,
+        'default_date_format': 'dd.mm.yyyy hh:mm'
+    })
+    worksheet = None
+    row_index = XLSX_MAX_ROWS
+    while rows:
+        for row in rows:
+            if row_index == XLSX_MAX_ROWS:
+                worksheet = workbook.add_worksheet()
+                worksheet.write_row(0, 0, columns)
+                row_index = 1
+            worksheet.write_row(row_index, 0, [export_cell(value) for value in row])
+            row_index += 1
+        written += len(rows)
+        rows = export_cursor.fetchmany(EXPORT_ITERSIZE)
+    if worksheet is None:
+        workbook.add_worksheet().write_row(0, 0, columns)
+    workbook.close()
+    return written
+
+def archive_orders_batch(cursor, months: int, batch_size: int) -> int:
+    '''Move one batch of long-issued orders and their participants to the archive tables'''
+    cursor.execute('SET LOCAL lock_timeout = %s', (ARCHIVE_LOCK_TIMEOUT,))
+    cursor.execute('''
+        WITH batch AS (
+            SELECT id FROM orders
+            WHERE status = 'issued'
+            AND status_changed_at < NOW() - make_interval(months => %s)
+            ORDER BY status_changed_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ),
+        moved_users AS (
+            DELETE FROM order_users ou
+            USING batch b
+            WHERE ou.order_id = b.id
+            RETURNING ou.*
+        ),
+        archived_users AS (
+            INSERT INTO order_users_archive
+            SELECT * FROM moved_users
+        ),
+        moved_orders AS (
+            DELETE FROM orders o
+            USING batch b
+            WHERE o.id = b.id
+            RETURNING o.*
+        )
+        INSERT INTO orders_archive
+        SELECT * FROM moved_orders
+    ''', (months, batch_size))
+    return cursor.rowcount
+
+def backfill_chat_user_ids(cursor, after_id: int, batch_size: int) -> Tuple[Optional[int], int]:
     '''
-    Business: API для управления заказами (создание, чтение, обновление статусов)
-    Args: event с httpMethod, body, queryStringParameters, headers с X-User-Id
-    Returns: HTTP response с данными заказов пользователя
+    Fill integer user_id from user_id_legacy for one id-ordered batch of old chat messages.
+    Returns the last scanned id (None when nothing is left) and the number of rows updated.
     '''
+    cursor.execute('''
+        WITH batch AS (
+            SELECT id, timestamp, user_id_legacy
+            FROM order_chat_messages
+            WHERE user_id IS NULL AND id > %s
+            ORDER BY id
+            LIMIT %s
+        ),
+        updated AS (
+            UPDATE order_chat_messages m
+            SET user_id = u.id
+            FROM batch b
+            INNER JOIN users u ON u.id = CASE
+                WHEN b.user_id_legacy ~ '^[0-9]{1,9}$' THEN b.user_id_legacy::integer
+            END
+            WHERE m.id = b.id AND m.timestamp = b.timestamp
+            RETURNING m.id
+        )
+        SELECT (SELECT MAX(id) FROM batch) AS last_id, (SELECT COUNT(*) FROM updated) AS updated
+    ''', (after_id, batch_size))
+    row = cursor.fetchone()
+    return row['last_id'], row['updated']
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''Route a request that has passed admission control'''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -30,18 +328,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-User-Role, X-Read-Primary-Until',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    conn = get_db_connection()
+    headers = event.get('headers', {})
+    user_id = headers.get('X-User-Id') or headers.get('x-user-id')
+    if method != 'GET':
+        remember_write(user_id)
+    conn = get_db_connection(read_only=method == 'GET', request_headers=headers, sticky_key=user_id)
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        headers = event.get('headers', {})
-        user_id = headers.get('X-User-Id') or headers.get('x-user-id')
         query_params = event.get('queryStringParameters', {}) or {}
         action = query_params.get('action')
         
@@ -66,7 +366,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         created_at,
                         status_changed_at,
                         history
-                    FROM orders
+                    FROM orders_all
                     WHERE master = %s
                     AND status = 'issued'
                     AND created_at::date >= %s::date
@@ -121,6 +421,345 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps(result, ensure_ascii=False, default=decimal_default)
                 }
         
+        if action == 'status-analytics':
+            if method == 'GET':
+                start_date = query_params.get('startDate', '').strip()
+                end_date = query_params.get('endDate', '').strip()
+                group_by = query_params.get('groupBy', 'status')
+                status_filter = query_params.get('status') or None
+                
+                group_columns = {
+                    'status': ['status'],
+                    'master': ['master', 'status'],
+                    'deviceType': ['device_type', 'status']
+                }.get(group_by)
+                
+                if not all([start_date, end_date]) or not group_columns:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'startDate, endDate and groupBy (status, master, deviceType) required'})
+                    }
+                
+                group_sql = ', '.join(group_columns)
+                cursor.execute(f'''
+                    WITH entries AS (
+                        SELECT 
+                            sh.new_status AS status,
+                            sh.changed_at AS entered_at,
+                            nx.changed_at AS exited_at,
+                            COALESCE(nx.was_overdue, o.is_overdue AND o.status = sh.new_status, false) AS overdue,
+                            o.master,
+                            o.device_type
+                        FROM status_history sh
+                        LEFT JOIN LATERAL (
+                            SELECT changed_at, was_overdue
+                            FROM status_history
+                            WHERE order_id = sh.order_id AND changed_at > sh.changed_at
+                            ORDER BY changed_at
+                            LIMIT 1
+                        ) nx ON TRUE
+                        LEFT JOIN orders_all o ON o.order_id = sh.order_id
+                        WHERE sh.changed_at >= %s::date
+                        AND sh.changed_at < %s::date + 1
+                        AND (%s::text IS NULL OR sh.new_status = %s)
+                    ),
+                    stats AS (
+                        SELECT 
+                            {group_sql},
+                            COUNT(*) AS entered,
+                            COUNT(exited_at) AS exited,
+                            percentile_cont(0.5) WITHIN GROUP (
+                                ORDER BY EXTRACT(EPOCH FROM exited_at - entered_at) / 3600
+                            ) AS p50_hours,
+                            percentile_cont(0.9) WITHIN GROUP (
+                                ORDER BY EXTRACT(EPOCH FROM exited_at - entered_at) / 3600
+                            ) AS p90_hours,
+                            AVG(CASE WHEN overdue THEN 1.0 ELSE 0.0 END) AS overdue_rate
+                        FROM entries
+                        GROUP BY {group_sql}
+                    )
+                    SELECT 
+                        *,
+                        RANK() OVER (ORDER BY p90_hours DESC NULLS LAST) AS bottleneck_rank,
+                        entered::float / NULLIF(SUM(entered) OVER (), 0) AS share
+                    FROM stats
+                    ORDER BY {group_sql}
+                ''', (start_date, end_date, status_filter, status_filter))
+                
+                rows = cursor.fetchall()
+                days = (datetime.strptime(end_date, '%Y-%m-%d') - datetime.strptime(start_date, '%Y-%m-%d')).days + 1
+                
+                result = []
+                for row in rows:
+                    item = {
+                        'status': row['status'],
+                        'entered': row['entered'],
+                        'exited': row['exited'],
+                        'throughputPerDay': row['exited'] / days if days > 0 else 0,
+                        'p50Hours': row['p50_hours'],
+                        'p90Hours': row['p90_hours'],
+                        'overdueRate': row['overdue_rate'],
+                        'share': row['share'],
+                        'bottleneckRank': row['bottleneck_rank']
+                    }
+                    if group_by == 'master':
+                        item['master'] = row['master']
+                    if group_by == 'deviceType':
+                        item['deviceType'] = row['device_type']
+                    result.append(item)
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({
+                        'groupBy': group_by,
+                        'startDate': start_date,
+                        'endDate': end_date,
+                        'rows': result
+                    }, ensure_ascii=False, default=decimal_default)
+                }
+        
+        if action == 'partition-maintenance':
+            if method == 'POST':
+                user_role = headers.get('X-User-Role') or headers.get('x-user-role')
+                if user_role != 'director':
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Forbidden: Only directors can maintain partitions'})
+                    }
+                
+                body_data = json.loads(event.get('body') or '{}')
+                months_ahead = int(body_data.get('monthsAhead', 3))
+                detach_before = body_data.get('detachBefore')
+                
+                if detach_before:
+                    today = date.today()
+                    limit_index = today.year * 12 + today.month - 1 - PARTITION_DETACH_MARGIN_MONTHS
+                    detach_limit = date(limit_index // 12, limit_index % 12 + 1, 1)
+                    try:
+                        detach_month = datetime.strptime(detach_before, '%Y-%m-%d').date().replace(day=1)
+                    except (TypeError, ValueError):
+                        detach_month = None
+                    if detach_month is None or detach_month > detach_limit:
+                        return {
+                            'statusCode': 400,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': f'detachBefore must be a YYYY-MM-DD date no later than {detach_limit.isoformat()}'})
+                        }
+                
+                result = {'created': {}, 'detached': {}}
+                for table, column in PARTITIONED_TABLES:
+                    cursor.execute(
+                        'SELECT ensure_monthly_partitions(%s, %s, %s) AS created',
+                        (table, column, months_ahead)
+                    )
+                    result['created'][table] = cursor.fetchone()['created']
+                    
+                    if detach_before:
+                        cursor.execute(
+                            'SELECT detach_partitions_before(%s, %s::date) AS name',
+                            (table, detach_before)
+                        )
+                        result['detached'][table] = [row['name'] for row in cursor.fetchall()]
+                
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps(result, ensure_ascii=False)
+                }
+        
+        if action == 'archive':
+            if method == 'POST':
+                user_role = headers.get('X-User-Role') or headers.get('x-user-role')
+                if user_role != 'director':
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Forbidden: Only directors can archive orders'})
+                    }
+                
+                body_data = json.loads(event.get('body') or '{}')
+                months = int(body_data.get('olderThanMonths', ARCHIVE_AFTER_MONTHS))
+                batch_size = min(int(body_data.get('batchSize', ARCHIVE_BATCH_SIZE)), ARCHIVE_BATCH_SIZE)
+                max_batches = int(body_data.get('maxBatches', ARCHIVE_MAX_BATCHES))
+                
+                archived = 0
+                batches = 0
+                lock_timeouts = 0
+                while batches < max_batches:
+                    try:
+                        moved = archive_orders_batch(cursor, months, batch_size)
+                        conn.commit()
+                    except LockNotAvailable:
+                        conn.rollback()
+                        lock_timeouts += 1
+                        break
+                    batches += 1
+                    archived += moved
+                    if moved < batch_size:
+                        break
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({
+                        'archived': archived,
+                        'batches': batches,
+                        'lockTimeouts': lock_timeouts,
+                        'olderThanMonths': months
+                    })
+                }
+        
+        if action == 'export':
+            if method == 'GET':
+                export_type = query_params.get('type', 'orders')
+                export_format = query_params.get('format', 'csv')
+                
+                if export_format not in EXPORT_CONTENT_TYPES or export_type not in ('orders', 'salary'):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'type (orders, salary) and format (csv, xlsx) required'})
+                    }
+                
+                if export_type == 'salary':
+                    master = query_params.get('master', '').strip()
+                    start_date = query_params.get('startDate', '').strip()
+                    end_date = query_params.get('endDate', '').strip()
+                    
+                    if not all([master, start_date, end_date]):
+                        return {
+                            'statusCode': 400,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'Missing required parameters'})
+                        }
+                    
+                    export_sql = '''
+                        SELECT 
+                            order_id as "orderId",
+                            created_at as "startDate",
+                            status_changed_at as "endDate",
+                            COALESCE(price, 0) as "salary",
+                            EXTRACT(DAY FROM status_changed_at - created_at)::int as "repairDays"
+                        FROM orders_all
+                        WHERE master = %s
+                        AND status = 'issued'
+                        AND created_at::date >= %s::date
+                        AND status_changed_at::date <= %s::date
+                        ORDER BY created_at
+                    '''
+                    export_params = (master, start_date, end_date)
+                else:
+                    include_archived = query_params.get('includeArchived') == 'true'
+                    export_sql, export_params = build_orders_list_query(user_id, include_archived)
+                
+                file_name = f"{export_type}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{export_format}"
+                fd, path = tempfile.mkstemp(suffix=f'.{export_format}')
+                os.close(fd)
+                
+                try:
+                    export_cursor = conn.cursor(name=f'export_{export_type}')
+                    export_cursor.itersize = EXPORT_ITERSIZE
+                    export_cursor.execute(export_sql, export_params)
+                    row_count = write_export(export_cursor, export_format, path)
+                    export_cursor.close()
+                    conn.rollback()
+                    
+                    size = os.path.getsize(path)
+                    if size <= EXPORT_INLINE_LIMIT:
+                        with open(path, 'rb') as f:
+                            content = base64.b64encode(f.read()).decode('ascii')
+                        return {
+                            'statusCode': 200,
+                            'headers': {
+                                'Content-Type': EXPORT_CONTENT_TYPES[export_format],
+                                'Content-Disposition': f'attachment; filename="{file_name}"',
+                                'Access-Control-Allow-Origin': '*'
+                            },
+                            'isBase64Encoded': True,
+                            'body': content
+                        }
+                    
+                    s3_client = get_s3_client()
+                    s3_bucket = os.environ.get('S3_BUCKET', 'poehali-files')
+                    storage_key = f'{EXPORT_PREFIX}{uuid.uuid4()}-{file_name}'
+                    s3_client.upload_file(
+                        path, s3_bucket, storage_key,
+                        ExtraArgs={'ContentType': EXPORT_CONTENT_TYPES[export_format]}
+                    )
+                    purge_expired_exports(s3_client, s3_bucket)
+                    download_url = s3_client.generate_presigned_url(
+                        'get_object',
+                        Params={
+                            'Bucket': s3_bucket,
+                            'Key': storage_key,
+                            'ResponseContentDisposition': f'attachment; filename="{file_name}"'
+                        },
+                        ExpiresIn=EXPORT_URL_EXPIRES
+                    )
+                finally:
+                    os.remove(path)
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({
+                        'url': download_url,
+                        'fileName': file_name,
+                        'rows': row_count,
+                        'size': size,
+                        'expiresIn': EXPORT_URL_EXPIRES
+                    })
+                }
+        
+        if action == 'chat-user-backfill':
+            if method == 'POST':
+                user_role = headers.get('X-User-Role') or headers.get('x-user-role')
+                if user_role != 'director':
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Forbidden: Only directors can run the chat backfill'})
+                    }
+                
+                body_data = json.loads(event.get('body') or '{}')
+                after_id = int(body_data.get('afterId', 0))
+                batch_size = min(int(body_data.get('batchSize', CHAT_BACKFILL_BATCH_SIZE)), CHAT_BACKFILL_BATCH_SIZE)
+                max_batches = int(body_data.get('maxBatches', ARCHIVE_MAX_BATCHES))
+                
+                updated = 0
+                batches = 0
+                done = False
+                while batches < max_batches:
+                    last_id, batch_updated = backfill_chat_user_ids(cursor, after_id, batch_size)
+                    conn.commit()
+                    if last_id is None:
+                        done = True
+                        break
+                    after_id = last_id
+                    updated += batch_updated
+                    batches += 1
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({
+                        'updated': updated,
+                        'batches': batches,
+                        'afterId': after_id,
+                        'done': done
+                    })
+                }
+        
         if action == 'search-chat':
             if method == 'GET':
                 search_query = query_params.get('q', '').strip()
@@ -164,6 +803,102 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps(order_ids, ensure_ascii=False)
                 }
         
+        if action == 'unread':
+            if method == 'GET':
+                if not user_id:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'X-User-Id required'})
+                    }
+                
+                cursor.execute('''
+                    SELECT uc.order_id, uc.unread_count
+                    FROM unread_counters uc
+                    INNER JOIN orders o ON o.order_id = uc.order_id
+                    INNER JOIN order_users ou ON ou.order_id = o.id AND ou.user_id = uc.user_id
+                    WHERE uc.user_id = %s AND uc.unread_count > 0
+                ''', (int(user_id),))
+                counters = {row['order_id']: row['unread_count'] for row in cursor.fetchall()}
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'total': sum(counters.values()), 'orders': counters}, ensure_ascii=False)
+                }
+        
+        if action == 'mark-read':
+            if method == 'POST':
+                body_data = json.loads(event.get('body') or '{}')
+                order_id = body_data.get('orderId')
+                message_id = body_data.get('messageId')
+                
+                if not user_id or not order_id:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'X-User-Id and orderId required'})
+                    }
+                
+                if not str(user_id).isdigit() or len(str(user_id)) > 9 or (message_id is not None and not str(message_id).isdigit()):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'X-User-Id and messageId must be numeric'})
+                    }
+                
+                # Clamp to the order's newest message so a foreign or future id cannot
+                # push last_read_message_id past messages that have not arrived yet.
+                cursor.execute('SELECT MAX(id) AS id FROM order_chat_messages WHERE order_id = %s', (order_id,))
+                max_message_id = cursor.fetchone()['id']
+                if max_message_id is None:
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'isBase64Encoded': False,
+                        'body': json.dumps({'lastReadMessageId': None, 'unread': 0})
+                    }
+                message_id = max_message_id if message_id is None else min(int(message_id), max_message_id)
+                
+                cursor.execute('''
+                    INSERT INTO chat_read_state (user_id, order_id, last_read_message_id)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (user_id, order_id) DO UPDATE
+                    SET last_read_message_id = GREATEST(chat_read_state.last_read_message_id, EXCLUDED.last_read_message_id),
+                        read_at = NOW()
+                    RETURNING last_read_message_id
+                ''', (int(user_id), order_id, int(message_id)))
+                last_read_id = cursor.fetchone()['last_read_message_id']
+                
+                # Lock the counter row first so a concurrent chat POST either lands
+                # before the recount below or increments after it, never in between.
+                cursor.execute('''
+                    INSERT INTO unread_counters (user_id, order_id, unread_count)
+                    VALUES (%s, %s, 0)
+                    ON CONFLICT (user_id, order_id) DO UPDATE
+                    SET unread_count = unread_counters.unread_count
+                ''', (int(user_id), order_id))
+                cursor.execute('''
+                    UPDATE unread_counters
+                    SET unread_count = (
+                        SELECT COUNT(*) FROM order_chat_messages
+                        WHERE order_id = %s AND id > %s AND user_id IS DISTINCT FROM %s
+                    ),
+                    updated_at = NOW()
+                    WHERE user_id = %s AND order_id = %s
+                    RETURNING unread_count
+                ''', (order_id, last_read_id, int(user_id), int(user_id), order_id))
+                unread = cursor.fetchone()['unread_count']
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'lastReadMessageId': str(last_read_id), 'unread': unread})
+                }
+        
         if action == 'chat':
             if method == 'GET':
                 order_id = query_params.get('orderId')
@@ -176,30 +911,30 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 cursor.execute('''
                     SELECT 
-                        ocm.id, 
-                        ocm.order_id, 
-                        ocm.user_id, 
-                        ocm.user_name, 
-                        ocm.message, 
-                        ocm.timestamp, 
-                        ocm.is_read,
-                        u.avatar_url
-                    FROM order_chat_messages ocm
-                    LEFT JOIN users u ON CAST(ocm.user_id AS INTEGER) = u.id
-                    WHERE ocm.order_id = %s
-                    ORDER BY ocm.timestamp ASC
+                        id, 
+                        order_id, 
+                        user_id, 
+                        user_id_legacy, 
+                        user_name, 
+                        message, 
+                        timestamp, 
+                        is_read
+                    FROM order_chat_messages
+                    WHERE order_id = %s
+                    ORDER BY timestamp ASC
                 ''', (order_id,))
                 
                 messages = cursor.fetchall()
+                avatars = get_user_avatars(cursor)
                 
                 result = []
                 for msg in messages:
                     result.append({
                         'id': str(msg['id']),
                         'orderId': msg['order_id'],
-                        'userId': str(msg['user_id']),
+                        'userId': str(msg['user_id']) if msg['user_id'] is not None else msg['user_id_legacy'],
                         'userName': msg['user_name'],
-                        'userAvatar': msg['avatar_url'],
+                        'userAvatar': avatars.get(msg['user_id']),
                         'message': msg['message'],
                         'timestamp': msg['timestamp'].isoformat() if msg['timestamp'] else None,
                         'isRead': msg['is_read']
@@ -227,13 +962,39 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'Missing required fields'})
                     }
                 
+                if not str(message_user_id).isdigit() or len(str(message_user_id)) > 9:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'userId must be numeric'})
+                    }
+                
+                cursor.execute('SELECT 1 FROM users WHERE id = %s', (int(message_user_id),))
+                if not cursor.fetchone():
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Unknown userId'})
+                    }
+                
                 cursor.execute('''
                     INSERT INTO order_chat_messages (order_id, user_id, user_name, message, timestamp, is_read)
                     VALUES (%s, %s, %s, %s, %s, %s)
                     RETURNING id
-                ''', (order_id, message_user_id, user_name, message, datetime.now(), False))
+                ''', (order_id, int(message_user_id), user_name, message, datetime.now(), False))
                 
                 message_id = cursor.fetchone()['id']
+                
+                cursor.execute('''
+                    INSERT INTO unread_counters (user_id, order_id, unread_count)
+                    SELECT ou.user_id, o.order_id, 1
+                    FROM orders o
+                    INNER JOIN order_users ou ON ou.order_id = o.id
+                    WHERE o.order_id = %s
+                    AND ou.user_id <> %s
+                    ON CONFLICT (user_id, order_id) DO UPDATE
+                    SET unread_count = unread_counters.unread_count + 1, updated_at = NOW()
+                ''', (order_id, int(message_user_id)))
                 conn.commit()
                 
                 return {
@@ -244,64 +1005,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
         
         if method == 'GET':
-            if user_id:
-                cursor.execute('''
-                    SELECT 
-                        o.order_id as "id",
-                        o.client_name as "clientName",
-                        o.client_address as "clientAddress",
-                        o.client_phone as "clientPhone",
-                        o.device_type as "deviceType",
-                        o.device_model as "deviceModel",
-                        o.serial_number as "serialNumber",
-                        o.issue,
-                        o.appearance,
-                        o.accessories,
-                        o.status,
-                        o.priority,
-                        o.repair_type as "repairType",
-                        TO_CHAR(o.created_at, 'DD.MM.YYYY') as "createdAt",
-                        o.created_time as "createdTime",
-                        o.price,
-                        o.master,
-                        o.history,
-                        o.repair_description as "repairDescription",
-                        TO_CHAR(o.status_deadline, 'YYYY-MM-DD"T"HH24:MI:SS') as "statusDeadline",
-                        TO_CHAR(o.status_changed_at, 'YYYY-MM-DD"T"HH24:MI:SS') as "statusChangedAt",
-                        o.is_overdue as "isOverdue"
-                    FROM orders o
-                    INNER JOIN order_users ou ON o.id = ou.order_id
-                    WHERE ou.user_id = %s
-                    ORDER BY o.created_at DESC
-                ''', (int(user_id),))
-            else:
-                cursor.execute('''
-                    SELECT 
-                        order_id as "id",
-                        client_name as "clientName",
-                        client_address as "clientAddress",
-                        client_phone as "clientPhone",
-                        device_type as "deviceType",
-                        device_model as "deviceModel",
-                        serial_number as "serialNumber",
-                        issue,
-                        appearance,
-                        accessories,
-                        status,
-                        priority,
-                        repair_type as "repairType",
-                        TO_CHAR(created_at, 'DD.MM.YYYY') as "createdAt",
-                        created_time as "createdTime",
-                        price,
-                        master,
-                        history,
-                        repair_description as "repairDescription",
-                        TO_CHAR(status_deadline, 'YYYY-MM-DD"T"HH24:MI:SS') as "statusDeadline",
-                        TO_CHAR(status_changed_at, 'YYYY-MM-DD"T"HH24:MI:SS') as "statusChangedAt",
-                        is_overdue as "isOverdue"
-                    FROM orders
-                    ORDER BY created_at DESC
-                ''')
+            include_archived = query_params.get('includeArchived') == 'true'
+            cursor.execute(*build_orders_list_query(user_id, include_archived))
             orders = cursor.fetchall()
             
             return {
@@ -316,6 +1021,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         elif method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
             
+            # order_id is unique per table only, and the client cannot see archived ids
+            cursor.execute('SELECT 1 FROM orders_all WHERE order_id = %s', (body_data['id'],))
+            if cursor.fetchone():
+                return {
+                    'statusCode': 409,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Order ID already exists'})
+                }
+            
             cursor.execute('''
                 INSERT INTO orders (
                     order_id, client_name, client_address, client_phone,
@@ -391,7 +1105,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             body_data = json.loads(event.get('body', '{}'))
             order_id = body_data.get('id')
             
-            cursor.execute('SELECT status FROM orders WHERE order_id = %s', (order_id,))
+            cursor.execute('''
+                SELECT 
+                    status,
+                    EXTRACT(EPOCH FROM (NOW() - status_changed_at)) / 3600 AS duration_hours,
+                    COALESCE(is_overdue OR (status_deadline IS NOT NULL AND NOW() > status_deadline), false) AS was_overdue
+                FROM orders
+                WHERE order_id = %s
+                FOR UPDATE
+            ''', (order_id,))
             old_status_row = cursor.fetchone()
             old_status = old_status_row['status'] if old_status_row else None
             new_status = body_data['status']
@@ -443,22 +1165,32 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 status_deadline,
                 order_id
             ))
+            updated_order = cursor.fetchone()
+            
+            if not updated_order:
+                conn.rollback()
+                cursor.execute('SELECT 1 FROM orders_archive WHERE order_id = %s', (order_id,))
+                if cursor.fetchone():
+                    return {
+                        'statusCode': 409,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Order is archived'})
+                    }
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Order not found'})
+                }
             
             if old_status and old_status != new_status:
-                cursor.execute('SELECT EXTRACT(EPOCH FROM (NOW() - status_changed_at))/3600 FROM orders WHERE order_id = %s', (order_id,))
-                duration_result = cursor.fetchone()
-                duration_hours = int(duration_result[0]) if duration_result and duration_result[0] else 0
-                
-                cursor.execute('SELECT is_overdue FROM orders WHERE order_id = %s', (order_id,))
-                overdue_result = cursor.fetchone()
-                was_overdue = overdue_result['is_overdue'] if overdue_result else False
+                duration_hours = int(old_status_row['duration_hours'] or 0)
+                was_overdue = old_status_row['was_overdue']
                 
                 cursor.execute('''
                     INSERT INTO status_history (order_id, old_status, new_status, changed_by, duration_hours, was_overdue)
                     VALUES (%s, %s, %s, %s, %s, %s)
                 ''', (order_id, old_status, new_status, body_data.get('changedBy', 'Система'), duration_hours, was_overdue))
             
-            updated_order = cursor.fetchone()
             conn.commit()
             
             return {
@@ -478,4 +1210,43 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: API для управления заказами (создание, чтение, обновление статусов)
+    Args: event с httpMethod, body, queryStringParameters, headers с X-User-Id
+    Returns: HTTP response с данными заказов пользователя
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    headers = event.get('headers', {}) or {}
+    user_id = headers.get('X-User-Id') or headers.get('x-user-id')
+    
+    if method == 'OPTIONS':
+        return handle_request(event, context)
+    
+    if user_id:
+        retry_after = take_token(user_id)
+        if retry_after:
+            return {
+                'statusCode': 429,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Expose-Headers': 'Retry-After',
+                    'Retry-After': str(math.ceil(retry_after))
+                },
+                'body': json.dumps({'error': 'Too many requests'})
+            }
+    
+    if method != 'GET':
+        return with_write_marker(handle_request(event, context))
+    
+    query_params = event.get('queryStringParameters', {}) or {}
+    key = (
+        tuple(sorted(query_params.items())),
+        user_id,
+        headers.get('If-None-Match') or headers.get('if-none-match'),
+        reads_pinned_to_primary(headers, user_id)
+    )
+    return coalesce(key, lambda: handle_request(event, context))
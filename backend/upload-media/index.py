@@ -1,19 +1,357 @@
 import json
 import base64
+import hashlib
+import io
 import os
+import threading
+import time
 import uuid
-from typing import Dict, Any
+from urllib.parse import urlparse, unquote
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
 import psycopg2
-from psycopg2.extras import RealDictCursor
-import boto3
+from psycopg2.extras import RealDictCursor, execute_values
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+MEDIA_CONTENT_TYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+    'mp4': 'video/mp4',
+    'mov': 'video/quicktime'
+}
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+PRESIGNED_URL_EXPIRES = 15 * 60
+
+MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024
+MULTIPART_MAX_PART_SIZE = 8 * 1024 * 1024
+MULTIPART_MAX_PARTS = 10000
+MULTIPART_STALE_HOURS = int(os.environ.get('MULTIPART_STALE_HOURS', '24'))
+
+PREVIEW_VARIANTS = {
+    'thumbnail': 320,
+    'preview': 1280
+}
+PREVIEW_WEBP_QUALITY = 80
+PREVIEW_WORKERS = 2
+PREVIEW_QUEUE_LIMIT = 32
+PREVIEW_BACKFILL_BATCH_SIZE = 20
+PREVIEW_BACKFILL_MIN_AGE_MINUTES = 10
+
+IMAGE_NORMALIZE = os.environ.get('IMAGE_NORMALIZE', 'false').lower() == 'true'
+IMAGE_MAX_EDGE = int(os.environ.get('IMAGE_MAX_EDGE', '2560'))
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', '85'))
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'jpeg').lower()
+NORMALIZABLE_EXTENSIONS = ('jpg', 'jpeg', 'png', 'webp')
+
+HASH_CHUNK_SIZE = 1024 * 1024
+DEDUP_STREAM_LIMIT = 50 * 1024 * 1024
+
+GC_PREFIXES = ('order-', 'avatars/')
+GC_GRACE_HOURS = int(os.environ.get('GC_GRACE_HOURS', '48'))
+GC_DELETE_BATCH_SIZE = 1000
+GC_REPORT_LIMIT = 1000
+GC_EXPORT_PREFIX = 'exports/'
+EXPORT_TTL_HOURS = 24
+
+BATCH_MAX_FILES = 20
+BATCH_LIST_MAX_ORDERS = 200
+UPLOAD_WORKERS = 8
+
+_preview_executor = None
+_preview_slots = threading.BoundedSemaphore(PREVIEW_QUEUE_LIMIT)
+_upload_executor = None
+
+_s3_client = None
+
+def get_s3_client():
+    '''Get S3 client, importing boto3 lazily and reusing it across warm invocations'''
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+        _s3_client = boto3.client(
+            's3',
+            endpoint_url=os.environ.get('S3_ENDPOINT', 'https://storage.yandexcloud.net'),
+            aws_access_key_id=os.environ.get('S3_ACCESS_KEY'),
+            aws_secret_access_key=os.environ.get('S3_SECRET_KEY')
+        )
+    return _s3_client
+
+READ_STICKY_SECONDS = 10
+READ_CONNECT_TIMEOUT = 2
+READ_MARKER_HEADER = 'X-Read-Primary-Until'
+
+def reads_pinned_to_primary(request_headers: Dict[str, Any]) -> bool:
     '''
-    Business: Upload and manage media files (photos/videos) for repair orders
-    Args: event - dict with httpMethod, body, queryStringParameters
-          context - object with attributes: request_id, function_name
-    Returns: HTTP response with file URL or list of media files
+    True while the caller must read its own writes. Clients echo the marker from their
+    last write response, which works across instances.
+    '''
+    marker = request_headers.get(READ_MARKER_HEADER) or request_headers.get(READ_MARKER_HEADER.lower())
+    try:
+        return bool(marker) and float(marker) > time.time()
+    except ValueError:
+        return False
+
+def get_db_connection(read_only: bool = False, request_headers: Optional[Dict[str, Any]] = None):
+    '''
+    Get database connection. Read-only requests go to DATABASE_READ_URL when it is set,
+    unless the caller's reads are pinned to the primary or the replica is unreachable.
+    '''
+    read_url = os.environ.get('DATABASE_READ_URL')
+    if read_only and read_url and not reads_pinned_to_primary(request_headers or {}):
+        try:
+            return psycopg2.connect(read_url, connect_timeout=READ_CONNECT_TIMEOUT)
+        except psycopg2.OperationalError:
+            pass
+    return psycopg2.connect(os.environ.get('DATABASE_URL'))
+
+def with_write_marker(response: Dict[str, Any]) -> Dict[str, Any]:
+    '''Attach the read-your-writes marker to a successful write response'''
+    if response.get('statusCode', 500) >= 400:
+        return response
+    response_headers = dict(response.get('headers') or {})
+    response_headers[READ_MARKER_HEADER] = f'{time.time() + READ_STICKY_SECONDS:.3f}'
+    exposed = response_headers.get('Access-Control-Expose-Headers')
+    response_headers['Access-Control-Expose-Headers'] = f'{exposed}, {READ_MARKER_HEADER}' if exposed else READ_MARKER_HEADER
+    return dict(response, headers=response_headers)
+
+def serialize_media(row: Dict[str, Any]) -> Dict[str, Any]:
+    '''Convert order_media row to API representation'''
+    return {
+        'id': row['id'],
+        'orderId': row['order_id'],
+        'fileUrl': row['file_url'],
+        'fileType': row['file_type'],
+        'fileName': row['file_name'],
+        'fileSize': row['file_size'],
+        'uploadedBy': row['uploaded_by'],
+        'uploadedAt': row['uploaded_at'].isoformat() if row['uploaded_at'] else None,
+        'description': row['description'],
+        'thumbnailUrl': row['thumbnail_url'],
+        'thumbnailSize': row['thumbnail_size'],
+        'previewUrl': row['preview_url'],
+        'previewSize': row['preview_size'],
+        'originalSize': row['original_size']
+    }
+
+def insert_order_media(cursor: Any, order_id: Any, file_url: str, file_type: str, file_name: str,
+                       file_size: int, uploaded_by: str, description: str,
+                       content_hash: Optional[str] = None, original_size: Optional[int] = None) -> int:
+    '''Insert order_media row and return its id; caller commits'''
+    cursor.execute('''
+        INSERT INTO order_media 
+        (order_id, file_url, file_type, file_name, file_size, uploaded_by, description,
+         content_hash, original_size)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING id
+    ''', (order_id, file_url, file_type, file_name, file_size, uploaded_by, description,
+          content_hash, original_size))
+    return cursor.fetchone()['id']
+
+def acquire_media_content(cursor: Any, content_hash: str) -> Optional[str]:
+    '''Take a reference to already stored content, returning its storage key if known'''
+    cursor.execute('''
+        UPDATE media_content
+        SET ref_count = ref_count + 1
+        WHERE content_hash = %s
+        RETURNING storage_key
+    ''', (content_hash,))
+    row = cursor.fetchone()
+    return row['storage_key'] if row else None
+
+def register_media_content(cursor: Any, content_hash: str, storage_key: str, file_size: int) -> str:
+    '''Record newly stored content; if a concurrent upload won, reference its key instead'''
+    cursor.execute('''
+        INSERT INTO media_content (content_hash, storage_key, file_size, ref_count)
+        VALUES (%s, %s, %s, 1)
+        ON CONFLICT (content_hash)
+        DO UPDATE SET ref_count = media_content.ref_count + 1
+        RETURNING storage_key
+    ''', (content_hash, storage_key, file_size))
+    return cursor.fetchone()['storage_key']
+
+def release_media_content(cursor: Any, content_hash: str) -> None:
+    '''Drop a reference; at zero the index row goes and GC reclaims the object'''
+    cursor.execute('''
+        UPDATE media_content
+        SET ref_count = ref_count - 1
+        WHERE content_hash = %s
+        RETURNING ref_count
+    ''', (content_hash,))
+    row = cursor.fetchone()
+    if row and row['ref_count'] <= 0:
+        cursor.execute('DELETE FROM media_content WHERE content_hash = %s AND ref_count <= 0', (content_hash,))
+
+def copy_previews(cursor: Any, media_id: int, content_hash: str) -> bool:
+    '''Reuse thumbnail/preview of an earlier row with the same content'''
+    cursor.execute('''
+        UPDATE order_media m
+        SET thumbnail_url = src.thumbnail_url, thumbnail_size = src.thumbnail_size,
+            preview_url = src.preview_url, preview_size = src.preview_size
+        FROM (
+            SELECT thumbnail_url, thumbnail_size, preview_url, preview_size
+            FROM order_media
+            WHERE content_hash = %s AND thumbnail_url IS NOT NULL
+            LIMIT 1
+        ) src
+        WHERE m.id = %s
+        RETURNING m.id
+    ''', (content_hash, media_id))
+    return cursor.fetchone() is not None
+
+def hash_s3_object(s3_client: Any, s3_bucket: str, key: str) -> str:
+    '''Compute SHA-256 of a stored object by streaming it in chunks'''
+    body = s3_client.get_object(Bucket=s3_bucket, Key=key)['Body']
+    digest = hashlib.sha256()
+    for chunk in body.iter_chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def list_uploaded_parts(s3_client: Any, s3_bucket: str, key: str, upload_id: str) -> List[Dict[str, Any]]:
+    '''List parts already stored for a multipart upload, following pagination'''
+    parts = []
+    marker = 0
+    while True:
+        response = s3_client.list_parts(
+            Bucket=s3_bucket, Key=key, UploadId=upload_id, PartNumberMarker=marker
+        )
+        for part in response.get('Parts', []):
+            parts.append({
+                'partNumber': part['PartNumber'],
+                'etag': part['ETag'],
+                'size': part['Size']
+            })
+        if not response.get('IsTruncated'):
+            return parts
+        marker = response['NextPartNumberMarker']
+
+def contiguous_part_count(parts: List[Dict[str, Any]]) -> int:
+    '''Number of parts forming an unbroken 1..N run from the start of a sorted part list'''
+    count = 0
+    for part in parts:
+        if part['partNumber'] != count + 1:
+            break
+        count += 1
+    return count
+
+def normalize_image(file_data: bytes, file_ext: str) -> Tuple[bytes, str]:
+    '''
+    Auto-rotate by EXIF, drop metadata, cap the long edge and re-encode.
+    Returns the input unchanged when disabled or the image cannot be processed.
+    '''
+    if not IMAGE_NORMALIZE or file_ext not in NORMALIZABLE_EXTENSIONS:
+        return file_data, file_ext
+    
+    try:
+        from PIL import Image, ImageOps
+        
+        image = Image.open(io.BytesIO(file_data))
+        if getattr(image, 'is_animated', False):
+            return file_data, file_ext
+        
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+        
+        buffer = io.BytesIO()
+        if IMAGE_FORMAT == 'webp':
+            image.save(buffer, 'WEBP', quality=IMAGE_QUALITY)
+            return buffer.getvalue(), 'webp'
+        
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(buffer, 'JPEG', quality=IMAGE_QUALITY, optimize=True, progressive=True)
+        return buffer.getvalue(), 'jpg'
+    except Exception as e:
+        print(f"Image normalization skipped: {e}")
+        return file_data, file_ext
+
+def get_preview_executor() -> ThreadPoolExecutor:
+    '''Get bounded thread pool for preview generation, shared across warm invocations'''
+    global _preview_executor
+    if _preview_executor is None:
+        _preview_executor = ThreadPoolExecutor(max_workers=PREVIEW_WORKERS)
+    return _preview_executor
+
+def get_upload_executor() -> ThreadPoolExecutor:
+    '''Get bounded thread pool for concurrent S3 uploads, shared across warm invocations'''
+    global _upload_executor
+    if _upload_executor is None:
+        _upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+    return _upload_executor
+
+def generate_previews(media_id: int, key: str) -> bool:
+    '''Render WebP thumbnail and preview for an image and store their URLs on the order_media row'''
+    try:
+        from PIL import Image, ImageOps
+        
+        s3_bucket = os.environ.get('S3_BUCKET', 'poehali-files')
+        s3_endpoint = os.environ.get('S3_ENDPOINT', 'https://storage.yandexcloud.net')
+        s3_client = get_s3_client()
+        
+        file_data = s3_client.get_object(Bucket=s3_bucket, Key=key)['Body'].read()
+        
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(file_data)))
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB')
+        
+        base_key = key.rsplit('.', 1)[0]
+        variants = {}
+        for variant, max_edge in PREVIEW_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((max_edge, max_edge))
+            buffer = io.BytesIO()
+            resized.save(buffer, 'WEBP', quality=PREVIEW_WEBP_QUALITY)
+            variant_data = buffer.getvalue()
+            variant_key = f"{base_key}-{variant}.webp"
+            
+            s3_client.put_object(
+                Bucket=s3_bucket,
+                Key=variant_key,
+                Body=variant_data,
+                ContentType='image/webp',
+                ACL='public-read',
+                CacheControl=IMMUTABLE_CACHE_CONTROL
+            )
+            variants[variant] = (f"{s3_endpoint}/{s3_bucket}/{variant_key}", len(variant_data))
+        
+        dsn = os.environ.get('DATABASE_URL')
+        conn = psycopg2.connect(dsn)
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                UPDATE order_media
+                SET thumbnail_url = %s, thumbnail_size = %s,
+                    preview_url = %s, preview_size = %s
+                WHERE id = %s
+            ''', (*variants['thumbnail'], *variants['preview'], media_id))
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        return True
+    except Exception as e:
+        print(f"Preview generation failed for media {media_id}: {e}")
+        return False
+
+def schedule_previews(media_id: int, key: str, file_type: str) -> None:
+    '''
+    Queue preview generation for image uploads without blocking the response.
+    Jobs hold only the key; when PREVIEW_QUEUE_LIMIT jobs are pending the upload is
+    left without previews and previews-backfill picks it up later.
     '''
+    if file_type != 'image' or not key.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
+        return
+    if not _preview_slots.acquire(blocking=False):
+        return
+    future = get_preview_executor().submit(generate_previews, media_id, key)
+    future.add_done_callback(lambda _: _preview_slots.release())
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''Route a request; handler adds the read-your-writes marker to write responses'''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -22,7 +360,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-User-Role, X-Read-Primary-Until',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -42,147 +380,881 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         elif method == 'PUT':
             return upload_avatar(event, headers)
     
-    if action == 'delete-avatar':
-        if method == 'POST':
-            return delete_avatar(event, headers)
+    if action == 'delete-avatar':
+        if method == 'POST':
+            return delete_avatar(event, headers)
+    
+    if action == 'batch-list':
+        if method == 'GET':
+            return get_batch_order_media(event, headers)
+    
+    if action == 'batch':
+        if method == 'POST':
+            return upload_media_batch(event, headers)
+    
+    if action == 'presign':
+        if method == 'POST':
+            return presign_media(event, headers)
+    
+    if action == 'confirm':
+        if method == 'POST':
+            return confirm_media(event, headers)
+    
+    if action == 'multipart-initiate':
+        if method == 'POST':
+            return multipart_initiate(event, headers)
+    
+    if action == 'multipart-part':
+        if method == 'POST':
+            return multipart_upload_part(event, headers)
+    
+    if action == 'multipart-status':
+        if method == 'GET':
+            return multipart_status(event, headers)
+    
+    if action == 'multipart-complete':
+        if method == 'POST':
+            return multipart_complete(event, headers)
+    
+    if action == 'multipart-abort':
+        if method == 'POST':
+            return multipart_abort(event, headers)
+    
+    if action == 'multipart-cleanup':
+        if method == 'POST':
+            return multipart_cleanup(event, headers)
+    
+    if action == 'previews-backfill':
+        if method == 'POST':
+            return backfill_previews(event, headers)
+    
+    if action == 'gc':
+        if method == 'POST':
+            return collect_media_gc(event, headers)
+    
+    if method == 'GET':
+        return get_order_media(event, headers)
+    elif method == 'POST':
+        return upload_media(event, headers)
+    elif method == 'DELETE':
+        return delete_media(event, headers)
+    
+    return {
+        'statusCode': 405,
+        'headers': headers,
+        'body': json.dumps({'error': 'Method not allowed'})
+    }
+
+
+def get_order_media(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    params = event.get('queryStringParameters', {}) or {}
+    order_id = params.get('orderId')
+    
+    if not order_id:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'orderId is required'})
+        }
+    
+    conn = get_db_connection(read_only=True, request_headers=event.get('headers') or {})
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        cursor.execute('''
+            SELECT id, order_id, file_url, file_type, file_name, 
+                   file_size, uploaded_by, uploaded_at, description,
+                   thumbnail_url, thumbnail_size, preview_url, preview_size, original_size
+            FROM order_media
+            WHERE order_id = %s
+            ORDER BY uploaded_at DESC
+        ''', (order_id,))
+        
+        rows = cursor.fetchall()
+        
+        media_list = [serialize_media(row) for row in rows]
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'isBase64Encoded': False,
+            'body': json.dumps(media_list)
+        }
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def get_batch_order_media(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    '''Media grouped by order for many orders, with optional per-order limit and file type filter'''
+    params = event.get('queryStringParameters', {}) or {}
+    order_ids = [order_id.strip() for order_id in (params.get('orderIds') or '').split(',') if order_id.strip()]
+    limit = params.get('limit')
+    file_type = params.get('fileType')
+    
+    if not order_ids:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'orderIds is required'})
+        }
+    
+    if len(order_ids) > BATCH_LIST_MAX_ORDERS:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': f'At most {BATCH_LIST_MAX_ORDERS} orderIds per request'})
+        }
+    
+    if limit is not None and (not limit.isdigit() or int(limit) < 1):
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'limit must be a positive integer'})
+        }
+    
+    conn = get_db_connection(read_only=True, request_headers=event.get('headers') or {})
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        cursor.execute('''
+            SELECT ids.order_id AS requested_order_id,
+                   stats.media_count, stats.total_bytes,
+                   m.id, m.order_id, m.file_url, m.file_type, m.file_name,
+                   m.file_size, m.uploaded_by, m.uploaded_at, m.description,
+                   m.thumbnail_url, m.thumbnail_size, m.preview_url, m.preview_size, m.original_size
+            FROM unnest(%s::text[]) AS ids(order_id)
+            CROSS JOIN LATERAL (
+                SELECT COUNT(*) AS media_count, COALESCE(SUM(file_size), 0) AS total_bytes
+                FROM order_media
+                WHERE order_id = ids.order_id
+                  AND (%s::text IS NULL OR file_type = %s)
+            ) stats
+            LEFT JOIN LATERAL (
+                SELECT *
+                FROM order_media
+                WHERE order_id = ids.order_id
+                  AND (%s::text IS NULL OR file_type = %s)
+                ORDER BY uploaded_at DESC
+                LIMIT %s
+            ) m ON TRUE
+            ORDER BY ids.order_id, m.uploaded_at DESC
+        ''', (order_ids, file_type, file_type, file_type, file_type, int(limit) if limit else None))
+        
+        grouped = {}
+        for row in cursor.fetchall():
+            group = grouped.setdefault(row['requested_order_id'], {
+                'media': [],
+                'count': row['media_count'],
+                'totalBytes': int(row['total_bytes'])
+            })
+            if row['id'] is not None:
+                group['media'].append(serialize_media(row))
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'isBase64Encoded': False,
+            'body': json.dumps(grouped)
+        }
+    finally:
+        cursor.close()
+        conn.close()
+
+def upload_media(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    body_data = json.loads(event.get('body', '{}'))
+    
+    order_id = body_data.get('orderId')
+    file_base64 = body_data.get('fileData')
+    file_name = body_data.get('fileName')
+    file_type = body_data.get('fileType', 'image')
+    uploaded_by = body_data.get('uploadedBy', 'Unknown')
+    description = body_data.get('description', '')
+    
+    if not all([order_id, file_base64, file_name]):
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Missing required fields: orderId, fileData, fileName'})
+        }
+    
+    try:
+        file_data = base64.b64decode(file_base64)
+        original_size = len(file_data)
+        
+        file_ext = file_name.split('.')[-1].lower() if '.' in file_name else 'jpg'
+        if file_type == 'image':
+            file_data, file_ext = normalize_image(file_data, file_ext)
+        file_size = len(file_data)
+        content_hash = hashlib.sha256(file_data).hexdigest()
+        
+        unique_name = f"order-{order_id}/{uuid.uuid4()}.{file_ext}"
+        
+        s3_bucket = os.environ.get('S3_BUCKET', 'poehali-files')
+        s3_endpoint = os.environ.get('S3_ENDPOINT', 'https://storage.yandexcloud.net')
+        
+        content_type = MEDIA_CONTENT_TYPES.get(file_ext, 'application/octet-stream')
+        
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        try:
+            storage_key = acquire_media_content(cursor, content_hash)
+            deduplicated = storage_key is not None
+            
+            if not deduplicated:
+                get_s3_client().put_object(
+                    Bucket=s3_bucket,
+                    Key=unique_name,
+                    Body=file_data,
+                    ContentType=content_type,
+                    ACL='public-read',
+                    CacheControl=IMMUTABLE_CACHE_CONTROL
+                )
+                storage_key = register_media_content(cursor, content_hash, unique_name, file_size)
+            
+            file_url = f"{s3_endpoint}/{s3_bucket}/{storage_key}"
+            
+            media_id = insert_order_media(
+                cursor, order_id, file_url, file_type, file_name, file_size, uploaded_by, description,
+                content_hash, original_size
+            )
+            has_previews = deduplicated and copy_previews(cursor, media_id, content_hash)
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        
+        if not has_previews:
+            schedule_previews(media_id, storage_key, file_type)
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'isBase64Encoded': False,
+            'body': json.dumps({
+                'id': media_id,
+                'fileUrl': file_url,
+                'fileName': file_name,
+                'fileType': file_type,
+                'fileSize': file_size,
+                'originalSize': original_size,
+                'deduplicated': deduplicated,
+                'success': True
+            })
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': json.dumps({'error': str(e)})
+        }
+
+
+def upload_media_batch(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    body_data = json.loads(event.get('body', '{}'))
+    
+    order_id = body_data.get('orderId')
+    uploaded_by = body_data.get('uploadedBy', 'Unknown')
+    files = body_data.get('files') or []
+    
+    if not order_id or not files:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Missing required fields: orderId, files'})
+        }
+    
+    if len(files) > BATCH_MAX_FILES:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': f'At most {BATCH_MAX_FILES} files per batch'})
+        }
+    
+    try:
+        s3_bucket = os.environ.get('S3_BUCKET', 'poehali-files')
+        s3_endpoint = os.environ.get('S3_ENDPOINT', 'https://storage.yandexcloud.net')
+        s3_client = get_s3_client()
+        
+        results = []
+        entries = []
+        for index, item in enumerate(files):
+            file_name = item.get('fileName')
+            if not item.get('fileData') or not file_name:
+                results.append({'index': index, 'fileName': file_name, 'success': False,
+                                'error': 'Missing required fields: fileData, fileName'})
+                continue
+            
+            try:
+                file_data = base64.b64decode(item['fileData'], validate=True)
+            except ValueError:
+                results.append({'index': index, 'fileName': file_name, 'success': False,
+                                'error': 'fileData is not valid base64'})
+                continue
+            original_size = len(file_data)
+            file_type = item.get('fileType', 'image')
+            file_ext = file_name.split('.')[-1].lower() if '.' in file_name else 'jpg'
+            if file_type == 'image':
+                file_data, file_ext = normalize_image(file_data, file_ext)
+            entries.append({
+                'index': index,
+                'fileName': file_name,
+                'fileType': file_type,
+                'description': item.get('description', ''),
+                'data': file_data,
+                'size': len(file_data),
+                'originalSize': original_size,
+                'hash': hashlib.sha256(file_data).hexdigest(),
+                'key': f"order-{order_id}/{uuid.uuid4()}.{file_ext}",
+                'contentType': MEDIA_CONTENT_TYPES.get(file_ext, 'application/octet-stream')
+            })
+        
+        stored = []
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        try:
+            known_keys = {}
+            pending = []
+            for entry in entries:
+                entry['upload'] = False
+                entry['repeat'] = entry['hash'] in known_keys
+                if entry['repeat']:
+                    entry['deduplicated'] = True
+                    continue
+                existing_key = acquire_media_content(cursor, entry['hash'])
+                entry['deduplicated'] = existing_key is not None
+                if existing_key:
+                    entry['key'] = existing_key
+                else:
+                    entry['upload'] = True
+                    pending.append(entry)
+                known_keys[entry['hash']] = entry['key']
+            
+            def put(entry: Dict[str, Any]) -> None:
+                s3_client.put_object(
+                    Bucket=s3_bucket,
+                    Key=entry['key'],
+                    Body=entry['data'],
+                    ContentType=entry['contentType'],
+                    ACL='public-read',
+                    CacheControl=IMMUTABLE_CACHE_CONTROL
+                )
+            
+            executor = get_upload_executor()
+            futures = [(entry, executor.submit(put, entry)) for entry in pending]
+            failed = {}
+            for entry, future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    failed[entry['hash']] = str(e)
+            
+            for entry in entries:
+                if entry['hash'] in failed:
+                    results.append({'index': entry['index'], 'fileName': entry['fileName'], 'success': False,
+                                    'error': failed[entry['hash']]})
+                    continue
+                if entry['upload']:
+                    entry['key'] = register_media_content(cursor, entry['hash'], entry['key'], entry['size'])
+                elif entry['repeat']:
+                    entry['key'] = acquire_media_content(cursor, entry['hash'])
+                entry['fileUrl'] = f"{s3_endpoint}/{s3_bucket}/{entry['key']}"
+                stored.append(entry)
+            
+            if stored:
+                rows = execute_values(cursor, '''
+                    INSERT INTO order_media 
+                    (order_id, file_url, file_type, file_name, file_size, uploaded_by, description,
+                     content_hash, original_size)
+                    VALUES %s
+                    RETURNING id
+                ''', [
+                    (order_id, entry['fileUrl'], entry['fileType'], entry['fileName'], entry['size'],
+                     uploaded_by, entry['description'], entry['hash'], entry['originalSize'])
+                    for entry in stored
+                ], fetch=True)
+                for entry, row in zip(stored, rows):
+                    entry['id'] = row['id']
+                    entry['hasPreviews'] = (
+                        entry['deduplicated'] and not entry['repeat']
+                        and copy_previews(cursor, entry['id'], entry['hash'])
+                    )
+            
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        
+        for entry in stored:
+            if not entry['hasPreviews']:
+                schedule_previews(entry['id'], entry['key'], entry['fileType'])
+            results.append({
+                'index': entry['index'],
+                'id': entry['id'],
+                'fileUrl': entry['fileUrl'],
+                'fileName': entry['fileName'],
+                'fileType': entry['fileType'],
+                'fileSize': entry['size'],
+                'originalSize': entry['originalSize'],
+                'deduplicated': entry['deduplicated'],
+                'success': True
+            })
+        
+        results.sort(key=lambda result: result['index'])
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'isBase64Encoded': False,
+            'body': json.dumps({
+                'files': results,
+                'uploaded': len(stored),
+                'failed': len(results) - len(stored),
+                'success': len(stored) == len(results)
+            })
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': json.dumps({'error': str(e)})
+        }
+
+def presign_media(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    body_data = json.loads(event.get('body', '{}'))
+    
+    order_id = body_data.get('orderId')
+    file_name = body_data.get('fileName')
+    
+    if not all([order_id, file_name]):
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Missing required fields: orderId, fileName'})
+        }
+    
+    try:
+        file_ext = file_name.split('.')[-1].lower() if '.' in file_name else 'jpg'
+        unique_name = f"order-{order_id}/{uuid.uuid4()}.{file_ext}"
+        content_type = MEDIA_CONTENT_TYPES.get(file_ext, 'application/octet-stream')
+        
+        s3_bucket = os.environ.get('S3_BUCKET', 'poehali-files')
+        s3_client = get_s3_client()
+        
+        upload_url = s3_client.generate_presigned_url(
+            'put_object',
+            Params={
+                'Bucket': s3_bucket,
+                'Key': unique_name,
+                'ContentType': content_type,
+                'ACL': 'public-read',
+                'CacheControl': IMMUTABLE_CACHE_CONTROL
+            },
+            ExpiresIn=PRESIGNED_URL_EXPIRES
+        )
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'isBase64Encoded': False,
+            'body': json.dumps({
+                'uploadUrl': upload_url,
+                'method': 'PUT',
+                'uploadHeaders': {
+                    'Content-Type': content_type,
+                    'x-amz-acl': 'public-read',
+                    'Cache-Control': IMMUTABLE_CACHE_CONTROL
+                },
+                'key': unique_name,
+                'expiresIn': PRESIGNED_URL_EXPIRES
+            })
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': json.dumps({'error': str(e)})
+        }
+
+
+def confirm_media(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    body_data = json.loads(event.get('body', '{}'))
+    
+    order_id = body_data.get('orderId')
+    key = body_data.get('key')
+    file_name = body_data.get('fileName')
+    file_type = body_data.get('fileType', 'image')
+    uploaded_by = body_data.get('uploadedBy', 'Unknown')
+    description = body_data.get('description', '')
+    
+    if not all([order_id, key, file_name]):
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Missing required fields: orderId, key, fileName'})
+        }
+    
+    if not key.startswith(f"order-{order_id}/"):
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Key does not belong to this order'})
+        }
+    
+    try:
+        from botocore.exceptions import ClientError
+        
+        s3_bucket = os.environ.get('S3_BUCKET', 'poehali-files')
+        s3_endpoint = os.environ.get('S3_ENDPOINT', 'https://storage.yandexcloud.net')
+        s3_client = get_s3_client()
+        
+        try:
+            head = s3_client.head_object(Bucket=s3_bucket, Key=key)
+        except ClientError:
+            return {
+                'statusCode': 404,
+                'headers': headers,
+                'body': json.dumps({'error': 'Uploaded object not found'})
+            }
+        
+        file_size = head['ContentLength']
+        content_hash = None
+        if file_size <= DEDUP_STREAM_LIMIT:
+            content_hash = hash_s3_object(s3_client, s3_bucket, key)
+        
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        try:
+            storage_key = key
+            deduplicated = False
+            if content_hash:
+                existing_key = acquire_media_content(cursor, content_hash)
+                deduplicated = existing_key is not None
+                if deduplicated:
+                    storage_key = existing_key
+                else:
+                    storage_key = register_media_content(cursor, content_hash, key, file_size)
+            
+            file_url = f"{s3_endpoint}/{s3_bucket}/{storage_key}"
+            
+            media_id = insert_order_media(
+                cursor, order_id, file_url, file_type, file_name, file_size, uploaded_by, description,
+                content_hash
+            )
+            has_previews = deduplicated and copy_previews(cursor, media_id, content_hash)
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        
+        if storage_key != key:
+            s3_client.delete_object(Bucket=s3_bucket, Key=key)
+        if not has_previews:
+            schedule_previews(media_id, storage_key, file_type)
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'isBase64Encoded': False,
+            'body': json.dumps({
+                'id': media_id,
+                'fileUrl': file_url,
+                'fileName': file_name,
+                'fileType': file_type,
+                'fileSize': file_size,
+                'deduplicated': deduplicated,
+                'success': True
+            })
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': json.dumps({'error': str(e)})
+        }
+
+
+def multipart_initiate(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    body_data = json.loads(event.get('body', '{}'))
+    
+    order_id = body_data.get('orderId')
+    file_name = body_data.get('fileName')
+    
+    if not all([order_id, file_name]):
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Missing required fields: orderId, fileName'})
+        }
+    
+    try:
+        file_ext = file_name.split('.')[-1].lower() if '.' in file_name else 'mp4'
+        unique_name = f"order-{order_id}/{uuid.uuid4()}.{file_ext}"
+        content_type = MEDIA_CONTENT_TYPES.get(file_ext, 'application/octet-stream')
+        
+        s3_bucket = os.environ.get('S3_BUCKET', 'poehali-files')
+        s3_client = get_s3_client()
+        
+        response = s3_client.create_multipart_upload(
+            Bucket=s3_bucket,
+            Key=unique_name,
+            ContentType=content_type,
+            ACL='public-read',
+            CacheControl=IMMUTABLE_CACHE_CONTROL
+        )
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'isBase64Encoded': False,
+            'body': json.dumps({
+                'uploadId': response['UploadId'],
+                'key': unique_name,
+                'minPartSize': MULTIPART_MIN_PART_SIZE,
+                'maxParts': MULTIPART_MAX_PARTS
+            })
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': json.dumps({'error': str(e)})
+        }
+
+
+def multipart_upload_part(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    '''
+    Upload one part: either accepts a single part as base64 in partData,
+    or returns a presigned URL so the client can PUT the part directly
+    '''
+    body_data = json.loads(event.get('body', '{}'))
+    
+    key = body_data.get('key')
+    upload_id = body_data.get('uploadId')
+    part_number = body_data.get('partNumber')
+    part_base64 = body_data.get('partData')
+    
+    if not all([key, upload_id, part_number]):
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Missing required fields: key, uploadId, partNumber'})
+        }
+    
+    if not str(part_number).isdigit() or not 1 <= int(part_number) <= MULTIPART_MAX_PARTS:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': f'partNumber must be between 1 and {MULTIPART_MAX_PARTS}'})
+        }
+    part_number = int(part_number)
     
-    if method == 'GET':
-        return get_order_media(event, headers)
-    elif method == 'POST':
-        return upload_media(event, headers)
-    elif method == 'DELETE':
-        return delete_media(event, headers)
+    # Inline parts pass through the function body; larger parts go through the presigned URL
+    if part_base64 and len(part_base64) > (MULTIPART_MAX_PART_SIZE + 2) // 3 * 4:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': f'Inline partData must decode to at most {MULTIPART_MAX_PART_SIZE} bytes; request an uploadUrl instead'})
+        }
     
-    return {
-        'statusCode': 405,
-        'headers': headers,
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
+    try:
+        s3_bucket = os.environ.get('S3_BUCKET', 'poehali-files')
+        s3_client = get_s3_client()
+        
+        if not part_base64:
+            upload_url = s3_client.generate_presigned_url(
+                'upload_part',
+                Params={
+                    'Bucket': s3_bucket,
+                    'Key': key,
+                    'UploadId': upload_id,
+                    'PartNumber': part_number
+                },
+                ExpiresIn=PRESIGNED_URL_EXPIRES
+            )
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'isBase64Encoded': False,
+                'body': json.dumps({
+                    'uploadUrl': upload_url,
+                    'method': 'PUT',
+                    'partNumber': part_number,
+                    'expiresIn': PRESIGNED_URL_EXPIRES
+                })
+            }
+        
+        try:
+            part_data = base64.b64decode(part_base64, validate=True)
+        except ValueError:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'partData is not valid base64'})
+            }
+        
+        response = s3_client.upload_part(
+            Bucket=s3_bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=part_data
+        )
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'isBase64Encoded': False,
+            'body': json.dumps({
+                'partNumber': part_number,
+                'etag': response['ETag'],
+                'size': len(part_data)
+            })
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': json.dumps({'error': str(e)})
+        }
 
 
-def get_order_media(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+def multipart_status(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
     params = event.get('queryStringParameters', {}) or {}
-    order_id = params.get('orderId')
+    key = params.get('key')
+    upload_id = params.get('uploadId')
     
-    if not order_id:
+    if not all([key, upload_id]):
         return {
             'statusCode': 400,
             'headers': headers,
-            'body': json.dumps({'error': 'orderId is required'})
+            'body': json.dumps({'error': 'key and uploadId are required'})
         }
     
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
     try:
-        cursor.execute('''
-            SELECT id, order_id, file_url, file_type, file_name, 
-                   file_size, uploaded_by, uploaded_at, description
-            FROM order_media
-            WHERE order_id = %s
-            ORDER BY uploaded_at DESC
-        ''', (order_id,))
+        from botocore.exceptions import ClientError
         
-        rows = cursor.fetchall()
+        s3_bucket = os.environ.get('S3_BUCKET', 'poehali-files')
+        s3_client = get_s3_client()
         
-        media_list = []
-        for row in rows:
-            media_list.append({
-                'id': row['id'],
-                'orderId': row['order_id'],
-                'fileUrl': row['file_url'],
-                'fileType': row['file_type'],
-                'fileName': row['file_name'],
-                'fileSize': row['file_size'],
-                'uploadedBy': row['uploaded_by'],
-                'uploadedAt': row['uploaded_at'].isoformat() if row['uploaded_at'] else None,
-                'description': row['description']
-            })
+        try:
+            parts = list_uploaded_parts(s3_client, s3_bucket, key, upload_id)
+        except ClientError:
+            return {
+                'statusCode': 404,
+                'headers': headers,
+                'body': json.dumps({'error': 'Upload not found'})
+            }
+        
+        next_part = contiguous_part_count(parts) + 1
         
         return {
             'statusCode': 200,
             'headers': headers,
             'isBase64Encoded': False,
-            'body': json.dumps(media_list)
+            'body': json.dumps({
+                'parts': parts,
+                'nextPartNumber': next_part,
+                'uploadedBytes': sum(part['size'] for part in parts)
+            })
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': json.dumps({'error': str(e)})
         }
-    finally:
-        cursor.close()
-        conn.close()
 
 
-def upload_media(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+def multipart_complete(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
     body_data = json.loads(event.get('body', '{}'))
     
     order_id = body_data.get('orderId')
-    file_base64 = body_data.get('fileData')
+    key = body_data.get('key')
+    upload_id = body_data.get('uploadId')
     file_name = body_data.get('fileName')
-    file_type = body_data.get('fileType', 'image')
+    file_type = body_data.get('fileType', 'video')
     uploaded_by = body_data.get('uploadedBy', 'Unknown')
     description = body_data.get('description', '')
+    part_count = body_data.get('partCount')
+    total_size = body_data.get('totalSize')
     
-    if not all([order_id, file_base64, file_name]):
+    if not all([order_id, key, upload_id, file_name]):
         return {
             'statusCode': 400,
             'headers': headers,
-            'body': json.dumps({'error': 'Missing required fields: orderId, fileData, fileName'})
+            'body': json.dumps({'error': 'Missing required fields: orderId, key, uploadId, fileName'})
+        }
+    
+    if part_count is None and total_size is None:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'partCount or totalSize is required'})
+        }
+    
+    if not key.startswith(f"order-{order_id}/"):
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Key does not belong to this order'})
         }
     
     try:
-        file_data = base64.b64decode(file_base64)
-        file_size = len(file_data)
-        
-        file_ext = file_name.split('.')[-1].lower() if '.' in file_name else 'jpg'
-        unique_name = f"order-{order_id}/{uuid.uuid4()}.{file_ext}"
-        
         s3_bucket = os.environ.get('S3_BUCKET', 'poehali-files')
         s3_endpoint = os.environ.get('S3_ENDPOINT', 'https://storage.yandexcloud.net')
+        s3_client = get_s3_client()
         
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=s3_endpoint,
-            aws_access_key_id=os.environ.get('S3_ACCESS_KEY'),
-            aws_secret_access_key=os.environ.get('S3_SECRET_KEY')
-        )
+        parts = list_uploaded_parts(s3_client, s3_bucket, key, upload_id)
+        if not parts:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'No parts uploaded'})
+            }
         
-        content_type_map = {
-            'jpg': 'image/jpeg',
-            'jpeg': 'image/jpeg',
-            'png': 'image/png',
-            'gif': 'image/gif',
-            'webp': 'image/webp',
-            'mp4': 'video/mp4',
-            'mov': 'video/quicktime'
-        }
-        content_type = content_type_map.get(file_ext, 'application/octet-stream')
+        uploaded_size = sum(part['size'] for part in parts)
+        contiguous = contiguous_part_count(parts)
+        if (contiguous != len(parts)
+                or (part_count is not None and int(part_count) != len(parts))
+                or (total_size is not None and int(total_size) != uploaded_size)):
+            return {
+                'statusCode': 409,
+                'headers': headers,
+                'body': json.dumps({
+                    'error': 'Upload is incomplete',
+                    'nextPartNumber': contiguous + 1,
+                    'uploadedParts': len(parts),
+                    'uploadedBytes': uploaded_size
+                })
+            }
         
-        s3_client.put_object(
+        s3_client.complete_multipart_upload(
             Bucket=s3_bucket,
-            Key=unique_name,
-            Body=file_data,
-            ContentType=content_type,
-            ACL='public-read'
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={
+                'Parts': [{'PartNumber': part['partNumber'], 'ETag': part['etag']} for part in parts]
+            }
         )
         
-        file_url = f"{s3_endpoint}/{s3_bucket}/{unique_name}"
+        file_size = uploaded_size
+        file_url = f"{s3_endpoint}/{s3_bucket}/{key}"
         
-        dsn = os.environ.get('DATABASE_URL')
-        conn = psycopg2.connect(dsn)
+        conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
-        cursor.execute('''
-            INSERT INTO order_media 
-            (order_id, file_url, file_type, file_name, file_size, uploaded_by, description)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        ''', (order_id, file_url, file_type, file_name, file_size, uploaded_by, description))
-        
-        result = cursor.fetchone()
-        media_id = result['id']
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        try:
+            media_id = insert_order_media(
+                cursor, order_id, file_url, file_type, file_name, file_size, uploaded_by, description
+            )
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
         
         return {
             'statusCode': 200,
@@ -205,6 +1277,275 @@ def upload_media(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, An
         }
 
 
+def multipart_abort(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    body_data = json.loads(event.get('body', '{}'))
+    
+    key = body_data.get('key')
+    upload_id = body_data.get('uploadId')
+    
+    if not all([key, upload_id]):
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Missing required fields: key, uploadId'})
+        }
+    
+    try:
+        s3_bucket = os.environ.get('S3_BUCKET', 'poehali-files')
+        s3_client = get_s3_client()
+        
+        s3_client.abort_multipart_upload(Bucket=s3_bucket, Key=key, UploadId=upload_id)
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps({'success': True})
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': json.dumps({'error': str(e)})
+        }
+
+
+def multipart_cleanup(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    '''Abort incomplete multipart uploads older than MULTIPART_STALE_HOURS'''
+    body_data = json.loads(event.get('body') or '{}')
+    stale_hours = int(body_data.get('staleHours', MULTIPART_STALE_HOURS))
+    
+    try:
+        s3_bucket = os.environ.get('S3_BUCKET', 'poehali-files')
+        s3_client = get_s3_client()
+        
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=stale_hours)
+        aborted = []
+        
+        paginator = s3_client.get_paginator('list_multipart_uploads')
+        for page in paginator.paginate(Bucket=s3_bucket, Prefix='order-'):
+            for upload in page.get('Uploads', []):
+                if upload['Initiated'] < cutoff:
+                    s3_client.abort_multipart_upload(
+                        Bucket=s3_bucket, Key=upload['Key'], UploadId=upload['UploadId']
+                    )
+                    aborted.append(upload['Key'])
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'isBase64Encoded': False,
+            'body': json.dumps({'aborted': len(aborted), 'keys': aborted, 'success': True})
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': json.dumps({'error': str(e)})
+        }
+
+def storage_key_from_url(url: str, s3_bucket: str) -> Optional[str]:
+    '''Object key of a bucket URL in path style (/bucket/key) or virtual-host style, or None if unrecognised'''
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return None
+    path = unquote(parsed.path)
+    if parsed.hostname and parsed.hostname.startswith(f'{s3_bucket}.'):
+        return path.lstrip('/') or None
+    bucket_prefix = f'/{s3_bucket}/'
+    if path.startswith(bucket_prefix):
+        return path[len(bucket_prefix):] or None
+    return None
+
+def backfill_previews(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    '''
+    Regenerate previews for image rows still without a thumbnail, e.g. when the background
+    job was frozen with its container. Rows are walked by id so permanent failures do not repeat.
+    '''
+    request_headers = event.get('headers', {}) or {}
+    user_role = request_headers.get('X-User-Role') or request_headers.get('x-user-role')
+    if user_role != 'director':
+        return {
+            'statusCode': 403,
+            'headers': headers,
+            'body': json.dumps({'error': 'Forbidden: Only directors can backfill previews'})
+        }
+    
+    body_data = json.loads(event.get('body') or '{}')
+    after_id = int(body_data.get('afterId', 0))
+    batch_size = min(int(body_data.get('batchSize', PREVIEW_BACKFILL_BATCH_SIZE)), PREVIEW_BACKFILL_BATCH_SIZE)
+    s3_bucket = os.environ.get('S3_BUCKET', 'poehali-files')
+    
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cursor.execute('''
+            SELECT id, file_url
+            FROM order_media
+            WHERE file_type = 'image'
+              AND thumbnail_url IS NULL
+              AND id > %s
+              AND uploaded_at < NOW() - make_interval(mins => %s)
+            ORDER BY id
+            LIMIT %s
+        ''', (after_id, PREVIEW_BACKFILL_MIN_AGE_MINUTES, batch_size))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+    
+    jobs = []
+    skipped = 0
+    for row in rows:
+        key = storage_key_from_url(row['file_url'], s3_bucket)
+        if key is None or not key.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
+            skipped += 1
+            continue
+        jobs.append(get_preview_executor().submit(generate_previews, row['id'], key))
+    
+    generated = sum(1 for job in jobs if job.result())
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'isBase64Encoded': False,
+        'body': json.dumps({
+            'scanned': len(rows),
+            'generated': generated,
+            'failed': len(jobs) - generated,
+            'skipped': skipped,
+            'afterId': rows[-1]['id'] if rows else after_id,
+            'done': len(rows) < batch_size
+        })
+    }
+
+def collect_media_gc(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    '''
+    Delete storage objects under media prefixes that no DB row references.
+    Objects younger than the grace period are kept so in-flight uploads survive.
+    '''
+    request_headers = event.get('headers', {}) or {}
+    user_role = request_headers.get('X-User-Role') or request_headers.get('x-user-role')
+    if user_role != 'director':
+        return {
+            'statusCode': 403,
+            'headers': headers,
+            'body': json.dumps({'error': 'Forbidden: Only directors can run media GC'})
+        }
+    
+    body_data = json.loads(event.get('body') or '{}')
+    dry_run = body_data.get('dryRun', True) is not False
+    grace_hours = max(int(body_data.get('graceHours', GC_GRACE_HOURS)), GC_GRACE_HOURS)
+    
+    try:
+        started = time.monotonic()
+        s3_bucket = os.environ.get('S3_BUCKET', 'poehali-files')
+        s3_client = get_s3_client()
+        
+        dsn = os.environ.get('DATABASE_URL')
+        conn = psycopg2.connect(dsn)
+        referenced = set()
+        unparsed_urls = []
+        try:
+            cursor = conn.cursor(name='media_gc_refs')
+            cursor.itersize = 5000
+            cursor.execute('''
+                SELECT file_url FROM order_media
+                UNION ALL SELECT thumbnail_url FROM order_media WHERE thumbnail_url IS NOT NULL
+                UNION ALL SELECT preview_url FROM order_media WHERE preview_url IS NOT NULL
+                UNION ALL SELECT avatar_url FROM users WHERE avatar_url IS NOT NULL
+            ''')
+            for (url,) in cursor:
+                key = storage_key_from_url(url, s3_bucket)
+                if key is None:
+                    unparsed_urls.append(url)
+                else:
+                    referenced.add(key)
+            cursor.close()
+        finally:
+            conn.close()
+        
+        if unparsed_urls and not dry_run:
+            return {
+                'statusCode': 409,
+                'headers': headers,
+                'body': json.dumps({
+                    'error': 'Some referenced URLs do not map to an object key in this bucket; refusing to delete',
+                    'unparsedUrls': unparsed_urls[:GC_REPORT_LIMIT]
+                })
+            }
+        
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=grace_hours)
+        metrics = {
+            'scannedObjects': 0,
+            'scannedBytes': 0,
+            'orphanObjects': 0,
+            'orphanBytes': 0,
+            'deletedObjects': 0,
+            'errors': 0
+        }
+        orphan_keys = []
+        batch = []
+        
+        def flush(keys: List[str]) -> None:
+            response = s3_client.delete_objects(
+                Bucket=s3_bucket,
+                Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+            )
+            errors = len(response.get('Errors', []))
+            metrics['errors'] += errors
+            metrics['deletedObjects'] += len(keys) - errors
+        
+        # Order exports are never referenced from the DB; they only live for EXPORT_TTL_HOURS
+        scans = [(prefix, cutoff, True) for prefix in GC_PREFIXES]
+        scans.append((GC_EXPORT_PREFIX, datetime.now(timezone.utc) - timedelta(hours=EXPORT_TTL_HOURS), False))
+        
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for prefix, prefix_cutoff, check_refs in scans:
+            for page in paginator.paginate(Bucket=s3_bucket, Prefix=prefix):
+                for obj in page.get('Contents', []):
+                    metrics['scannedObjects'] += 1
+                    metrics['scannedBytes'] += obj['Size']
+                    
+                    if (check_refs and obj['Key'] in referenced) or obj['LastModified'] >= prefix_cutoff:
+                        continue
+                    
+                    metrics['orphanObjects'] += 1
+                    metrics['orphanBytes'] += obj['Size']
+                    if len(orphan_keys) < GC_REPORT_LIMIT:
+                        orphan_keys.append(obj['Key'])
+                    
+                    if not dry_run:
+                        batch.append(obj['Key'])
+                        if len(batch) == GC_DELETE_BATCH_SIZE:
+                            flush(batch)
+                            batch = []
+        
+        if batch:
+            flush(batch)
+        
+        metrics['durationMs'] = int((time.monotonic() - started) * 1000)
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'isBase64Encoded': False,
+            'body': json.dumps({
+                'dryRun': dry_run,
+                'graceHours': grace_hours,
+                'metrics': metrics,
+                'orphanKeys': orphan_keys,
+                'unparsedUrls': unparsed_urls[:GC_REPORT_LIMIT],
+                'success': True
+            })
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': json.dumps({'error': str(e)})
+        }
+
 def delete_media(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
     params = event.get('queryStringParameters', {}) or {}
     media_id = params.get('id')
@@ -221,7 +1562,7 @@ def delete_media(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, An
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        cursor.execute('SELECT file_url FROM order_media WHERE id = %s', (media_id,))
+        cursor.execute('SELECT file_url, content_hash FROM order_media WHERE id = %s', (media_id,))
         row = cursor.fetchone()
         
         if not row:
@@ -232,6 +1573,8 @@ def delete_media(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, An
             }
         
         cursor.execute('DELETE FROM order_media WHERE id = %s', (media_id,))
+        if row['content_hash']:
+            release_media_content(cursor, row['content_hash'])
         conn.commit()
         
         return {
@@ -270,17 +1613,12 @@ def upload_avatar(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, A
             }
         
         file_ext = file_name.split('.')[-1].lower() if '.' in file_name else 'jpg'
-        unique_name = f"avatars/user-{user_id}.{file_ext}"
+        content_version = hashlib.sha256(file_data).hexdigest()[:16]
+        unique_name = f"avatars/user-{user_id}-{content_version}.{file_ext}"
         
         s3_bucket = os.environ.get('S3_BUCKET', 'poehali-files')
         s3_endpoint = os.environ.get('S3_ENDPOINT', 'https://storage.yandexcloud.net')
-        
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=s3_endpoint,
-            aws_access_key_id=os.environ.get('S3_ACCESS_KEY'),
-            aws_secret_access_key=os.environ.get('S3_SECRET_KEY')
-        )
+        s3_client = get_s3_client()
         
         content_type_map = {
             'jpg': 'image/jpeg',
@@ -296,7 +1634,8 @@ def upload_avatar(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, A
             Key=unique_name,
             Body=file_data,
             ContentType=content_type,
-            ACL='public-read'
+            ACL='public-read',
+            CacheControl=IMMUTABLE_CACHE_CONTROL
         )
         
         avatar_url = f"{s3_endpoint}/{s3_bucket}/{unique_name}"
@@ -392,4 +1731,17 @@ def delete_avatar(event: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, A
             'statusCode': 500,
             'headers': headers,
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Upload and manage media files (photos/videos) for repair orders
+    Args: event - dict with httpMethod, body, queryStringParameters
+          context - object with attributes: request_id, function_name
+    Returns: HTTP response with file URL or list of media files
+    '''
+    response = handle_request(event, context)
+    if event.get('httpMethod', 'GET') in ('GET', 'OPTIONS'):
+        return response
+    return with_write_marker(response)
@@ -0,0 +1,11 @@
+-- Add resized WebP variants for order photos
+ALTER TABLE order_media ADD COLUMN IF NOT EXISTS thumbnail_url TEXT;
+ALTER TABLE order_media ADD COLUMN IF NOT EXISTS thumbnail_size INTEGER;
+ALTER TABLE order_media ADD COLUMN IF NOT EXISTS preview_url TEXT;
+ALTER TABLE order_media ADD COLUMN IF NOT EXISTS preview_size INTEGER;
+
+-- Add comments to columns
+COMMENT ON COLUMN order_media.thumbnail_url IS 'Public URL to the small WebP thumbnail used in media grids';
+COMMENT ON COLUMN order_media.thumbnail_size IS 'Thumbnail size in bytes';
+COMMENT ON COLUMN order_media.preview_url IS 'Public URL to the medium WebP preview used in the viewer';
+COMMENT ON COLUMN order_media.preview_size IS 'Preview size in bytes';
@@ -0,0 +1,18 @@
+-- Content index for deduplicating uploaded media by SHA-256
+CREATE TABLE IF NOT EXISTS media_content (
+    content_hash CHAR(64) PRIMARY KEY,
+    storage_key TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    ref_count INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE order_media ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+
+CREATE INDEX IF NOT EXISTS idx_order_media_content_hash ON order_media(content_hash);
+
+-- Add comments
+COMMENT ON TABLE media_content IS 'Stored media objects keyed by content hash, shared by order_media rows';
+COMMENT ON COLUMN media_content.storage_key IS 'S3 key of the single stored copy';
+COMMENT ON COLUMN media_content.ref_count IS 'Number of order_media rows pointing at this object';
+COMMENT ON COLUMN order_media.content_hash IS 'SHA-256 of file contents, NULL for uploads made before deduplication';
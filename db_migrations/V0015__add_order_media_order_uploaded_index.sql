@@ -0,0 +1,2 @@
+-- Composite index for per-order media listing ordered by upload time
+CREATE INDEX IF NOT EXISTS idx_order_media_order_uploaded ON order_media(order_id, uploaded_at DESC);
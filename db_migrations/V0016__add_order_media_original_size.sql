@@ -0,0 +1,4 @@
+-- Keep the size of the file as uploaded when it was normalized before storage
+ALTER TABLE order_media ADD COLUMN IF NOT EXISTS original_size INTEGER;
+
+COMMENT ON COLUMN order_media.original_size IS 'Size in bytes of the file as uploaded, before image normalization';
@@ -0,0 +1,16 @@
+-- Trigram indexes for substring client search and a digits-only phone column
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- 11-digit Russian numbers lose the leading 7/8 so "+7 (999) ..." and "8999..." compare equal
+ALTER TABLE t_p43469238_repair_tracking_app.clients
+ADD COLUMN IF NOT EXISTS phone_digits VARCHAR(50)
+GENERATED ALWAYS AS (
+    regexp_replace(regexp_replace(phone, '\D', '', 'g'), '^[78](\d{10})$', '\1')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_clients_full_name_trgm ON t_p43469238_repair_tracking_app.clients USING gin(full_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_clients_address_trgm ON t_p43469238_repair_tracking_app.clients USING gin(address gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_clients_phone_digits_trgm ON t_p43469238_repair_tracking_app.clients USING gin(phone_digits gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_client_devices_serial_number_trgm ON t_p43469238_repair_tracking_app.client_devices USING gin(serial_number gin_trgm_ops);
+
+COMMENT ON COLUMN t_p43469238_repair_tracking_app.clients.phone_digits IS 'Телефон только цифрами без кода страны 7/8 для поиска';
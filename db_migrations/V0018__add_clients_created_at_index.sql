@@ -0,0 +1,2 @@
+-- Index for the default "latest clients" listing so it reads only the first N rows
+CREATE INDEX IF NOT EXISTS idx_clients_created_at ON t_p43469238_repair_tracking_app.clients(created_at DESC);
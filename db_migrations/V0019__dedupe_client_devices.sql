@@ -0,0 +1,25 @@
+-- Один и тот же аппарат клиента хранится одной строкой: по серийному номеру, иначе по типу и модели
+ALTER TABLE t_p43469238_repair_tracking_app.client_devices
+ADD COLUMN IF NOT EXISTS device_key TEXT
+GENERATED ALWAYS AS (
+    CASE
+        WHEN NULLIF(btrim(serial_number), '') IS NOT NULL THEN 'sn:' || lower(btrim(serial_number))
+        ELSE 'tm:' || lower(btrim(device_type)) || '|' || lower(COALESCE(btrim(device_model), ''))
+    END
+) STORED;
+
+-- Однократное сжатие накопившихся дублей, остаётся самая ранняя запись
+DELETE FROM t_p43469238_repair_tracking_app.client_devices cd
+USING t_p43469238_repair_tracking_app.client_devices keep
+WHERE cd.client_id = keep.client_id
+  AND cd.device_key = keep.device_key
+  AND cd.id > keep.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_client_devices_client_device_key
+ON t_p43469238_repair_tracking_app.client_devices(client_id, device_key);
+
+-- История заказов клиента по телефону
+CREATE INDEX IF NOT EXISTS idx_orders_client_phone
+ON t_p43469238_repair_tracking_app.orders(client_phone, created_at DESC);
+
+COMMENT ON COLUMN t_p43469238_repair_tracking_app.client_devices.device_key IS 'Ключ устройства клиента: серийный номер или тип+модель';
@@ -0,0 +1,17 @@
+-- Журнал массовых импортов клиентов: прогресс и отчёт об отклонённых строках
+CREATE TABLE IF NOT EXISTS t_p43469238_repair_tracking_app.client_imports (
+    id SERIAL PRIMARY KEY,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    format VARCHAR(10) NOT NULL,
+    processed_rows INTEGER NOT NULL DEFAULT 0,
+    inserted_clients INTEGER NOT NULL DEFAULT 0,
+    updated_clients INTEGER NOT NULL DEFAULT 0,
+    added_devices INTEGER NOT NULL DEFAULT 0,
+    rejected_rows INTEGER NOT NULL DEFAULT 0,
+    rejected_report JSONB NOT NULL DEFAULT '[]'::jsonb,
+    error TEXT,
+    started_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMP
+);
+
+COMMENT ON TABLE t_p43469238_repair_tracking_app.client_imports IS 'Массовые импорты клиентов из CSV/NDJSON';
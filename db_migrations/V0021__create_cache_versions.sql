@@ -0,0 +1,33 @@
+-- Счётчики версий справочников для кэша в обработчиках: любая запись в таблицу увеличивает версию
+CREATE TABLE IF NOT EXISTS t_p43469238_repair_tracking_app.cache_versions (
+    name VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO t_p43469238_repair_tracking_app.cache_versions (name) VALUES
+('users'),
+('device_types')
+ON CONFLICT (name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION t_p43469238_repair_tracking_app.bump_cache_version()
+RETURNS trigger AS $$
+BEGIN
+    UPDATE t_p43469238_repair_tracking_app.cache_versions
+    SET version = version + 1, updated_at = NOW()
+    WHERE name = TG_ARGV[0];
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_cache_version ON t_p43469238_repair_tracking_app.users;
+CREATE TRIGGER trg_users_cache_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON t_p43469238_repair_tracking_app.users
+FOR EACH STATEMENT EXECUTE FUNCTION t_p43469238_repair_tracking_app.bump_cache_version('users');
+
+DROP TRIGGER IF EXISTS trg_device_types_cache_version ON t_p43469238_repair_tracking_app.device_types;
+CREATE TRIGGER trg_device_types_cache_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON t_p43469238_repair_tracking_app.device_types
+FOR EACH STATEMENT EXECUTE FUNCTION t_p43469238_repair_tracking_app.bump_cache_version('device_types');
+
+COMMENT ON TABLE t_p43469238_repair_tracking_app.cache_versions IS 'Версии справочников (users, device_types) для проверки кэша в обработчиках';
@@ -0,0 +1,3 @@
+-- Индексы для аналитики времени нахождения в статусах
+CREATE INDEX IF NOT EXISTS idx_status_history_order_changed ON t_p43469238_repair_tracking_app.status_history(order_id, changed_at);
+CREATE INDEX IF NOT EXISTS idx_status_history_status_changed ON t_p43469238_repair_tracking_app.status_history(new_status, changed_at);
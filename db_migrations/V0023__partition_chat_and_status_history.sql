@@ -0,0 +1,164 @@
+-- Помесячное секционирование order_chat_messages и status_history
+
+-- Создаёт недостающие месячные секции от from_month до текущего месяца + months_ahead.
+-- Ранее отсоединённая секция присоединяется обратно, а не считается существующей.
+-- Строки, попавшие за это время в DEFAULT-секцию, переносятся в новую секцию.
+CREATE OR REPLACE FUNCTION t_p43469238_repair_tracking_app.ensure_monthly_partitions(
+    parent_table text,
+    partition_column text,
+    months_ahead integer DEFAULT 3,
+    from_month date DEFAULT NULL
+) RETURNS integer AS $$
+DECLARE
+    month_start date := date_trunc('month', COALESCE(from_month, now()::date))::date;
+    last_month date := (date_trunc('month', now()) + make_interval(months => months_ahead))::date;
+    partition_name text;
+    created integer := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        partition_name := parent_table || '_p' || to_char(month_start, 'YYYY_MM');
+        IF NOT EXISTS (
+            SELECT 1
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 't_p43469238_repair_tracking_app'
+              AND c.relname = partition_name
+              AND i.inhparent = ('t_p43469238_repair_tracking_app.' || quote_ident(parent_table))::regclass
+        ) THEN
+            IF to_regclass('t_p43469238_repair_tracking_app.' || partition_name) IS NULL THEN
+                EXECUTE format(
+                    'CREATE TABLE t_p43469238_repair_tracking_app.%I (LIKE t_p43469238_repair_tracking_app.%I INCLUDING DEFAULTS)',
+                    partition_name, parent_table
+                );
+            END IF;
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM t_p43469238_repair_tracking_app.%I WHERE %I >= %L AND %I < %L RETURNING *) '
+                'INSERT INTO t_p43469238_repair_tracking_app.%I SELECT * FROM moved',
+                parent_table || '_default', partition_column, month_start,
+                partition_column, (month_start + interval '1 month')::date, partition_name
+            );
+            EXECUTE format(
+                'ALTER TABLE t_p43469238_repair_tracking_app.%I ATTACH PARTITION t_p43469238_repair_tracking_app.%I '
+                'FOR VALUES FROM (%L) TO (%L)',
+                parent_table, partition_name, month_start, (month_start + interval '1 month')::date
+            );
+            created := created + 1;
+        END IF;
+        month_start := (month_start + interval '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Отсоединяет месячные секции старше before_month для дешёвой архивации (таблицы остаются).
+-- Текущий и прошлый месяцы отсоединить нельзя: обработчики читают их постоянно.
+CREATE OR REPLACE FUNCTION t_p43469238_repair_tracking_app.detach_partitions_before(
+    parent_table text,
+    before_month date
+) RETURNS SETOF text AS $$
+DECLARE
+    child record;
+BEGIN
+    IF date_trunc('month', before_month) > date_trunc('month', now()) - interval '1 month' THEN
+        RAISE EXCEPTION 'before_month % is too recent to detach', before_month;
+    END IF;
+    
+    FOR child IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        JOIN pg_namespace n ON n.oid = p.relnamespace
+        WHERE n.nspname = 't_p43469238_repair_tracking_app'
+          AND p.relname = parent_table
+          AND c.relname ~ '_p\d{4}_\d{2}$'
+          AND to_date(substring(c.relname FROM '_p(\d{4}_\d{2})$'), 'YYYY_MM') < date_trunc('month', before_month)
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format(
+            'ALTER TABLE t_p43469238_repair_tracking_app.%I DETACH PARTITION t_p43469238_repair_tracking_app.%I',
+            parent_table, child.relname
+        );
+        RETURN NEXT child.relname;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- order_chat_messages
+ALTER TABLE t_p43469238_repair_tracking_app.order_chat_messages RENAME TO order_chat_messages_legacy;
+
+CREATE TABLE t_p43469238_repair_tracking_app.order_chat_messages (
+    id INTEGER NOT NULL DEFAULT nextval('t_p43469238_repair_tracking_app.order_chat_messages_id_seq'),
+    order_id VARCHAR(50) NOT NULL,
+    user_id VARCHAR(100) NOT NULL,
+    user_name VARCHAR(255) NOT NULL,
+    message TEXT NOT NULL,
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    is_read BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+ALTER SEQUENCE t_p43469238_repair_tracking_app.order_chat_messages_id_seq
+OWNED BY t_p43469238_repair_tracking_app.order_chat_messages.id;
+
+CREATE TABLE t_p43469238_repair_tracking_app.order_chat_messages_default
+PARTITION OF t_p43469238_repair_tracking_app.order_chat_messages DEFAULT;
+
+SELECT t_p43469238_repair_tracking_app.ensure_monthly_partitions(
+    'order_chat_messages', 'timestamp', 3,
+    (SELECT MIN(timestamp)::date FROM t_p43469238_repair_tracking_app.order_chat_messages_legacy)
+);
+
+INSERT INTO t_p43469238_repair_tracking_app.order_chat_messages
+(id, order_id, user_id, user_name, message, timestamp, is_read, created_at)
+SELECT id, order_id, user_id, user_name, message, timestamp, is_read, created_at
+FROM t_p43469238_repair_tracking_app.order_chat_messages_legacy;
+
+DROP TABLE t_p43469238_repair_tracking_app.order_chat_messages_legacy;
+
+CREATE INDEX IF NOT EXISTS idx_chat_order_id ON t_p43469238_repair_tracking_app.order_chat_messages(order_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_chat_timestamp ON t_p43469238_repair_tracking_app.order_chat_messages(timestamp);
+CREATE INDEX IF NOT EXISTS idx_chat_message_search ON t_p43469238_repair_tracking_app.order_chat_messages USING gin(to_tsvector('russian', message));
+
+COMMENT ON TABLE t_p43469238_repair_tracking_app.order_chat_messages IS 'Chat messages for order discussions between team members, partitioned by month';
+
+-- status_history
+ALTER TABLE t_p43469238_repair_tracking_app.status_history RENAME TO status_history_legacy;
+
+CREATE TABLE t_p43469238_repair_tracking_app.status_history (
+    id INTEGER NOT NULL DEFAULT nextval('t_p43469238_repair_tracking_app.status_history_id_seq'),
+    order_id character varying(50) NOT NULL,
+    old_status character varying(50),
+    new_status character varying(50) NOT NULL,
+    changed_at timestamp without time zone NOT NULL DEFAULT now(),
+    changed_by character varying(255),
+    duration_hours integer,
+    was_overdue boolean DEFAULT false,
+    PRIMARY KEY (id, changed_at)
+) PARTITION BY RANGE (changed_at);
+
+ALTER SEQUENCE t_p43469238_repair_tracking_app.status_history_id_seq
+OWNED BY t_p43469238_repair_tracking_app.status_history.id;
+
+CREATE TABLE t_p43469238_repair_tracking_app.status_history_default
+PARTITION OF t_p43469238_repair_tracking_app.status_history DEFAULT;
+
+SELECT t_p43469238_repair_tracking_app.ensure_monthly_partitions(
+    'status_history', 'changed_at', 3,
+    (SELECT MIN(changed_at)::date FROM t_p43469238_repair_tracking_app.status_history_legacy)
+);
+
+INSERT INTO t_p43469238_repair_tracking_app.status_history
+(id, order_id, old_status, new_status, changed_at, changed_by, duration_hours, was_overdue)
+SELECT id, order_id, old_status, new_status, changed_at, changed_by, duration_hours, was_overdue
+FROM t_p43469238_repair_tracking_app.status_history_legacy;
+
+DROP TABLE t_p43469238_repair_tracking_app.status_history_legacy;
+
+CREATE INDEX IF NOT EXISTS idx_status_history_order_id ON t_p43469238_repair_tracking_app.status_history(order_id);
+CREATE INDEX IF NOT EXISTS idx_status_history_order_changed ON t_p43469238_repair_tracking_app.status_history(order_id, changed_at);
+CREATE INDEX IF NOT EXISTS idx_status_history_status_changed ON t_p43469238_repair_tracking_app.status_history(new_status, changed_at);
+
+COMMENT ON TABLE t_p43469238_repair_tracking_app.status_history IS 'История смены статусов заказов с контролем длительности, секционирована по месяцам';
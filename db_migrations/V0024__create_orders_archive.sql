@@ -0,0 +1,25 @@
+-- Архив выданных заказов: холодные таблицы с той же структурой, что и рабочие
+CREATE TABLE IF NOT EXISTS t_p43469238_repair_tracking_app.orders_archive (
+    LIKE t_p43469238_repair_tracking_app.orders INCLUDING ALL
+);
+ALTER TABLE t_p43469238_repair_tracking_app.orders_archive
+    ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP NOT NULL DEFAULT NOW();
+
+CREATE TABLE IF NOT EXISTS t_p43469238_repair_tracking_app.order_users_archive (
+    LIKE t_p43469238_repair_tracking_app.order_users INCLUDING ALL
+);
+
+-- Отбор кандидатов на архивацию без полного сканирования orders
+CREATE INDEX IF NOT EXISTS idx_orders_issued_changed ON t_p43469238_repair_tracking_app.orders(status_changed_at)
+    WHERE status = 'issued';
+
+-- Представления для отчётов, которые должны видеть и рабочие, и архивные заказы
+CREATE OR REPLACE VIEW t_p43469238_repair_tracking_app.orders_all AS
+    SELECT o.*, NULL::timestamp AS archived_at FROM t_p43469238_repair_tracking_app.orders o
+    UNION ALL
+    SELECT * FROM t_p43469238_repair_tracking_app.orders_archive;
+
+CREATE OR REPLACE VIEW t_p43469238_repair_tracking_app.order_users_all AS
+    SELECT * FROM t_p43469238_repair_tracking_app.order_users
+    UNION ALL
+    SELECT * FROM t_p43469238_repair_tracking_app.order_users_archive;
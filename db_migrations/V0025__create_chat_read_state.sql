@@ -0,0 +1,21 @@
+-- Состояние прочтения чатов: последнее прочитанное сообщение для пары (пользователь, заказ)
+CREATE TABLE IF NOT EXISTS t_p43469238_repair_tracking_app.chat_read_state (
+    user_id INTEGER NOT NULL REFERENCES t_p43469238_repair_tracking_app.users(id),
+    order_id VARCHAR(50) NOT NULL,
+    last_read_message_id INTEGER NOT NULL,
+    read_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, order_id)
+);
+
+-- Счётчики непрочитанных, поддерживаются при отправке сообщения и при отметке прочтения.
+-- Существующие сообщения считаются прочитанными: счётчики стартуют с нуля.
+CREATE TABLE IF NOT EXISTS t_p43469238_repair_tracking_app.unread_counters (
+    user_id INTEGER NOT NULL REFERENCES t_p43469238_repair_tracking_app.users(id),
+    order_id VARCHAR(50) NOT NULL,
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, order_id)
+);
+
+-- Пересчёт непрочитанных после отметки: сообщения заказа с id больше прочитанного
+CREATE INDEX IF NOT EXISTS idx_chat_order_message_id ON t_p43469238_repair_tracking_app.order_chat_messages(order_id, id);
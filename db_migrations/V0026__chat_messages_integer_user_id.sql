@@ -0,0 +1,22 @@
+-- Перевод order_chat_messages.user_id с VARCHAR на INTEGER с внешним ключом на users
+
+-- Новый столбец пустой, поэтому проверка внешнего ключа при добавлении дешёвая
+ALTER TABLE t_p43469238_repair_tracking_app.order_chat_messages
+    ADD COLUMN IF NOT EXISTS author_id INTEGER REFERENCES t_p43469238_repair_tracking_app.users(id);
+
+ALTER TABLE t_p43469238_repair_tracking_app.order_chat_messages
+    ALTER COLUMN user_id DROP NOT NULL;
+ALTER TABLE t_p43469238_repair_tracking_app.order_chat_messages
+    RENAME COLUMN user_id TO user_id_legacy;
+ALTER TABLE t_p43469238_repair_tracking_app.order_chat_messages
+    RENAME COLUMN author_id TO user_id;
+
+CREATE INDEX IF NOT EXISTS idx_chat_user_id ON t_p43469238_repair_tracking_app.order_chat_messages(user_id);
+
+-- Заполнение user_id для старых сообщений выполняется отдельно, пачками с фиксацией каждой
+-- (POST orders ?action=chat-user-backfill), чтобы миграция не держала блокировки на всей таблице.
+-- Нечисловые и несуществующие идентификаторы остаются NULL, исходное значение хранится в user_id_legacy.
+CREATE INDEX IF NOT EXISTS idx_chat_user_backfill ON t_p43469238_repair_tracking_app.order_chat_messages(id)
+    WHERE user_id IS NULL;
+
+COMMENT ON COLUMN t_p43469238_repair_tracking_app.order_chat_messages.user_id_legacy IS 'Исходный строковый user_id до V0026, только для чтения';
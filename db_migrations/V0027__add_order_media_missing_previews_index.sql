@@ -0,0 +1,3 @@
+-- Partial index for previews-backfill: image rows still waiting for thumbnails
+CREATE INDEX IF NOT EXISTS idx_order_media_missing_previews ON order_media(id)
+    WHERE file_type = 'image' AND thumbnail_url IS NULL;
@@ -6,6 +6,7 @@ import { useToast } from '@/hooks/use-toast';
 import Icon from '@/components/ui/icon';
 import RoleBadge from '@/components/RoleBadge';
 import { roleLabels, UserRole } from '@/contexts/AuthContext';
+import { apiFetch } from '@/lib/api';
 
 interface User {
   id: string;
@@ -43,7 +44,7 @@ export default function AssignUserDialog({ orderId, isOpen, onClose }: AssignUse
 
   const loadUsers = async () => {
     try {
-      const response = await fetch(`${ORDER_USERS_API_URL}?listUsers=true`);
+      const response = await apiFetch(`${ORDER_USERS_API_URL}?listUsers=true`);
       if (response.ok) {
         const data = await response.json();
         setAllUsers(data);
@@ -60,7 +61,7 @@ export default function AssignUserDialog({ orderId, isOpen, onClose }: AssignUse
 
   const loadOrderUsers = async () => {
     try {
-      const response = await fetch(`${ORDER_USERS_API_URL}?orderId=${orderId}`);
+      const response = await apiFetch(`${ORDER_USERS_API_URL}?orderId=${orderId}`);
       if (response.ok) {
         const data = await response.json();
         setOrderUsers(data);
@@ -73,7 +74,7 @@ export default function AssignUserDialog({ orderId, isOpen, onClose }: AssignUse
   const handleAddUser = async (userId: string) => {
     try {
       setIsLoading(true);
-      const response = await fetch(ORDER_USERS_API_URL, {
+      const response = await apiFetch(ORDER_USERS_API_URL, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ orderId, userId, role: 'assigned' }),
@@ -102,7 +103,7 @@ export default function AssignUserDialog({ orderId, isOpen, onClose }: AssignUse
   const handleRemoveUser = async (userId: string) => {
     try {
       setIsLoading(true);
-      const response = await fetch(ORDER_USERS_API_URL, {
+      const response = await apiFetch(ORDER_USERS_API_URL, {
         method: 'DELETE',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ orderId, userId }),
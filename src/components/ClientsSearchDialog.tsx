@@ -5,6 +5,7 @@ import { Label } from '@/components/ui/label';
 import { ScrollArea } from '@/components/ui/scroll-area';
 import { Badge } from '@/components/ui/badge';
 import Icon from '@/components/ui/icon';
+import { apiFetch } from '@/lib/api';
 
 interface Client {
   id: number;
@@ -41,7 +42,7 @@ export default function ClientsSearchDialog({ isOpen, onClose }: ClientsSearchDi
   const loadClients = async () => {
     try {
       setIsLoading(true);
-      const response = await fetch(CLIENTS_API_URL);
+      const response = await apiFetch(CLIENTS_API_URL);
       if (response.ok) {
         const data = await response.json();
         setClients(data);
@@ -69,7 +70,7 @@ export default function ClientsSearchDialog({ isOpen, onClose }: ClientsSearchDi
         params.append(searchField, searchQuery);
       }
 
-      const response = await fetch(`${CLIENTS_API_URL}?${params}`);
+      const response = await apiFetch(`${CLIENTS_API_URL}?${params}`);
       if (response.ok) {
         const data = await response.json();
         setClients(data);
@@ -8,6 +8,7 @@ import { useToast } from '@/hooks/use-toast';
 import Icon from '@/components/ui/icon';
 import { ScrollArea } from '@/components/ui/scroll-area';
 import { useAuth } from '@/contexts/AuthContext';
+import { apiFetch } from '@/lib/api';
 
 interface DeviceType {
   id: number;
@@ -48,7 +49,7 @@ export default function DeviceTypesDialog({ isOpen, onClose }: DeviceTypesDialog
   const loadDeviceTypes = async () => {
     try {
       setIsLoading(true);
-      const response = await fetch(DEVICE_TYPES_API_URL);
+      const response = await apiFetch(DEVICE_TYPES_API_URL);
       if (response.ok) {
         const data = await response.json();
         setDeviceTypes(data);
@@ -79,7 +80,7 @@ export default function DeviceTypesDialog({ isOpen, onClose }: DeviceTypesDialog
 
     try {
       setIsAdding(true);
-      const response = await fetch(DEVICE_TYPES_API_URL, {
+      const response = await apiFetch(DEVICE_TYPES_API_URL, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -115,7 +116,7 @@ export default function DeviceTypesDialog({ isOpen, onClose }: DeviceTypesDialog
     }
 
     try {
-      const response = await fetch(DEVICE_TYPES_API_URL, {
+      const response = await apiFetch(DEVICE_TYPES_API_URL, {
         method: 'DELETE',
         headers: {
           'Content-Type': 'application/json',
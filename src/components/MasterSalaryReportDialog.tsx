@@ -17,6 +17,7 @@ import { Input } from '@/components/ui/input';
 import { Label } from '@/components/ui/label';
 import Icon from '@/components/ui/icon';
 import { useToast } from '@/hooks/use-toast';
+import { apiFetch } from '@/lib/api';
 
 interface MasterSalaryReportDialogProps {
   open: boolean;
@@ -65,7 +66,7 @@ export default function MasterSalaryReportDialog({
 
     try {
       setIsLoading(true);
-      const response = await fetch(
+      const response = await apiFetch(
         `${ORDERS_API_URL}?action=salary-report&master=${encodeURIComponent(selectedMaster)}&startDate=${startDate}&endDate=${endDate}`,
         {
           method: 'GET',
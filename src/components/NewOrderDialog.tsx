@@ -17,6 +17,7 @@ import {
   DEVICE_TYPES_API_URL, 
   CLIENTS_API_URL 
 } from './NewOrderDialog/types';
+import { apiFetch } from '@/lib/api';
 
 export type { NewOrderFormData };
 
@@ -78,7 +79,7 @@ export default function NewOrderDialog({ open, onOpenChange, onSubmit }: NewOrde
 
   const loadDeviceTypes = async () => {
     try {
-      const response = await fetch(DEVICE_TYPES_API_URL);
+      const response = await apiFetch(DEVICE_TYPES_API_URL);
       if (response.ok) {
         const data = await response.json();
         setDeviceTypes(data);
@@ -97,7 +98,7 @@ export default function NewOrderDialog({ open, onOpenChange, onSubmit }: NewOrde
 
     try {
       const params = new URLSearchParams({ [field]: query });
-      const response = await fetch(`${CLIENTS_API_URL}?${params}`);
+      const response = await apiFetch(`${CLIENTS_API_URL}?${params}`);
       if (response.ok) {
         const data = await response.json();
         setClientSuggestions(data);
@@ -161,7 +162,7 @@ export default function NewOrderDialog({ open, onOpenChange, onSubmit }: NewOrde
     e.preventDefault();
     if (validate()) {
       try {
-        await fetch(CLIENTS_API_URL, {
+        await apiFetch(CLIENTS_API_URL, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({
@@ -4,6 +4,7 @@ import { Textarea } from '@/components/ui/textarea';
 import { ScrollArea } from '@/components/ui/scroll-area';
 import Icon from '@/components/ui/icon';
 import { useAuth } from '@/contexts/AuthContext';
+import { apiFetch } from '@/lib/api';
 
 interface ChatMessage {
   id: string;
@@ -54,7 +55,7 @@ export default function OrderChatSection({ orderId }: OrderChatSectionProps) {
         headers['X-User-Id'] = user.id;
       }
 
-      const response = await fetch(`${ORDERS_API_URL}?action=chat&orderId=${orderId}`, { headers });
+      const response = await apiFetch(`${ORDERS_API_URL}?action=chat&orderId=${orderId}`, { headers });
       if (response.ok) {
         const data = await response.json();
         setMessages(data);
@@ -86,7 +87,7 @@ export default function OrderChatSection({ orderId }: OrderChatSectionProps) {
         timestamp: new Date().toISOString(),
       };
 
-      const response = await fetch(`${ORDERS_API_URL}?action=chat`, {
+      const response = await apiFetch(`${ORDERS_API_URL}?action=chat`, {
         method: 'POST',
         headers,
         body: JSON.stringify(messageData),
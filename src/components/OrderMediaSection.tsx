@@ -13,6 +13,7 @@ import {
 import Icon from '@/components/ui/icon';
 import { useAuth } from '@/contexts/AuthContext';
 import { useToast } from '@/hooks/use-toast';
+import { apiFetch } from '@/lib/api';
 
 interface MediaFile {
   id: number;
@@ -24,6 +25,10 @@ interface MediaFile {
   uploadedBy: string;
   uploadedAt: string;
   description: string;
+  thumbnailUrl: string | null;
+  thumbnailSize: number | null;
+  previewUrl: string | null;
+  previewSize: number | null;
 }
 
 interface OrderMediaSectionProps {
@@ -68,7 +73,7 @@ export default function OrderMediaSection({ orderId }: OrderMediaSectionProps) {
         headers['X-User-Id'] = user.id;
       }
 
-      const response = await fetch(`${MEDIA_API_URL}?orderId=${orderId}`, { headers });
+      const response = await apiFetch(`${MEDIA_API_URL}?orderId=${orderId}`, { headers });
       if (response.ok) {
         const data = await response.json();
         setMedia(data);
@@ -112,7 +117,7 @@ export default function OrderMediaSection({ orderId }: OrderMediaSectionProps) {
           headers['X-User-Id'] = user.id;
         }
 
-        const response = await fetch(MEDIA_API_URL, {
+        const response = await apiFetch(MEDIA_API_URL, {
           method: 'POST',
           headers,
           body: JSON.stringify({
@@ -202,11 +207,11 @@ export default function OrderMediaSection({ orderId }: OrderMediaSectionProps) {
             <div
               key={file.id}
               className="group relative border rounded-lg overflow-hidden bg-muted cursor-pointer hover:ring-2 hover:ring-primary transition-all"
-              onClick={() => setSelectedImage(file.fileUrl)}
+              onClick={() => setSelectedImage(file.previewUrl || file.fileUrl)}
             >
               <div className="aspect-square relative">
                 <img
-                  src={file.fileUrl}
+                  src={file.thumbnailUrl || file.fileUrl}
                   alt={file.fileName}
                   className="w-full h-full object-cover"
                   loading="lazy"
@@ -11,6 +11,7 @@ import {
 import Icon from '@/components/ui/icon';
 import { useAuth } from '@/contexts/AuthContext';
 import { useToast } from '@/hooks/use-toast';
+import { apiFetch } from '@/lib/api';
 
 interface UserAvatarUploadProps {
   open: boolean;
@@ -81,7 +82,7 @@ export default function UserAvatarUpload({ open, onOpenChange }: UserAvatarUploa
           headers['X-User-Id'] = user.id;
         }
 
-        const response = await fetch(`${UPLOAD_API_URL}?action=avatar`, {
+        const response = await apiFetch(`${UPLOAD_API_URL}?action=avatar`, {
           method: 'POST',
           headers,
           body: JSON.stringify({
@@ -134,7 +135,7 @@ export default function UserAvatarUpload({ open, onOpenChange }: UserAvatarUploa
         headers['X-User-Id'] = user.id;
       }
 
-      const response = await fetch(`${UPLOAD_API_URL}?action=delete-avatar`, {
+      const response = await apiFetch(`${UPLOAD_API_URL}?action=delete-avatar`, {
         method: 'POST',
         headers,
         body: JSON.stringify({
@@ -1,4 +1,5 @@
 import { useState, useEffect } from 'react';
+import { apiFetch } from '@/lib/api';
 
 const ORDERS_API_URL = 'https://functions.poehali.dev/e9af1ae4-2b09-4ac1-a49a-bf1172ebfc8c';
 
@@ -23,7 +24,7 @@ export function useChatSearch(searchQuery: string, userId?: string) {
           headers['X-User-Id'] = userId;
         }
         
-        const response = await fetch(
+        const response = await apiFetch(
           `${ORDERS_API_URL}?action=search-chat&q=${encodeURIComponent(searchQuery)}`,
           {
             method: 'GET',
@@ -4,6 +4,7 @@ import { Order, API_URL, mockOrders } from '@/lib/orderUtils';
 import { OrderStatus } from '@/components/OrderCard';
 import { NewOrderFormData } from '@/components/NewOrderDialog';
 import { UserRole } from '@/contexts/AuthContext';
+import { apiFetch } from '@/lib/api';
 
 interface User {
   id: string;
@@ -26,7 +27,7 @@ export function useOrders(user: User | null) {
         headers['X-User-Id'] = user.id;
       }
       
-      const response = await fetch(API_URL, { headers });
+      const response = await apiFetch(API_URL, { headers });
       if (response.ok) {
         const data = await response.json();
         setOrders(data);
@@ -93,7 +94,7 @@ export function useOrders(user: User | null) {
         headers['X-User-Id'] = user.id;
       }
       
-      const response = await fetch(API_URL, {
+      const response = await apiFetch(API_URL, {
         method: 'POST',
         headers,
         body: JSON.stringify(newOrder),
@@ -107,6 +108,13 @@ export function useOrders(user: User | null) {
           description: `Заказ ${newOrderId} сохранен в базе данных`,
         });
         return savedOrder;
+      } else if (response.status === 409) {
+        toast({
+          title: 'Заказ не создан',
+          description: `Номер ${newOrderId} уже занят, в том числе архивным заказом`,
+          variant: 'destructive',
+        });
+        return null;
       } else {
         throw new Error('Ошибка сохранения');
       }
@@ -176,10 +184,15 @@ export function useOrders(user: User | null) {
       historyItem.details = 'Назначен мастер';
     }
 
+    const headers: HeadersInit = { 'Content-Type': 'application/json' };
+    if (user?.id) {
+      headers['X-User-Id'] = user.id;
+    }
+
     try {
-      const response = await fetch(API_URL, {
+      const response = await apiFetch(API_URL, {
         method: 'PUT',
-        headers: { 'Content-Type': 'application/json' },
+        headers,
         body: JSON.stringify(updatedOrder),
       });
 
@@ -234,10 +247,15 @@ export function useOrders(user: User | null) {
       history: [...order.history, historyItem],
     };
 
+    const headers: HeadersInit = { 'Content-Type': 'application/json' };
+    if (user?.id) {
+      headers['X-User-Id'] = user.id;
+    }
+
     try {
-      const response = await fetch(API_URL, {
+      const response = await apiFetch(API_URL, {
         method: 'PUT',
-        headers: { 'Content-Type': 'application/json' },
+        headers,
         body: JSON.stringify(updatedOrder),
       });
 
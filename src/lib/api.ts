@@ -0,0 +1,20 @@
+const READ_MARKER_HEADER = 'X-Read-Primary-Until';
+
+let readPrimaryUntil = '';
+
+// Backend write responses carry a marker telling the next reads to skip the read replica
+// for a few seconds, so the user sees their own changes on any function instance.
+export async function apiFetch(input: RequestInfo | URL, init: RequestInit = {}): Promise<Response> {
+  const headers = new Headers(init.headers);
+  if (readPrimaryUntil) {
+    headers.set(READ_MARKER_HEADER, readPrimaryUntil);
+  }
+
+  const response = await fetch(input, { ...init, headers });
+
+  const marker = response.headers.get(READ_MARKER_HEADER);
+  if (marker && Number(marker) > Number(readPrimaryUntil || 0)) {
+    readPrimaryUntil = marker;
+  }
+  return response;
+}
@@ -109,6 +109,7 @@ export default function Index() {
 
   const onCreateOrder = useCallback(async (formData: any) => {
     const newOrder = await handleCreateOrder(formData);
+    if (!newOrder) return;
     setCreatedOrder(newOrder);
     setShowPrintConfirm(true);
   }, [handleCreateOrder]);